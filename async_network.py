@@ -0,0 +1,518 @@
+import asyncio, pickle, struct, queue, threading, socket, random
+import time
+import concurrent.futures
+from concurrent.futures import Future
+from network import (
+    Network,
+    REQUEST_TIMEOUT,
+    HEADER,
+    LARGE_FRAME,
+    LARGE_HEADER,
+    RAW,
+    CHUNK,
+    CHANNEL,
+    CHUNK_SIZE,
+    INTERACTIVE,
+    BULK,
+    BULK_WINDOW,
+    FEATURES,
+    Transfer,
+    chunk_frame,
+    encode_frames,
+)
+from heartbeat import HEARTBEAT_INTERVAL, DEAD_PEER_TIMEOUT
+
+MAX_QUEUED_MESSAGES = 1000  # messages waiting for the pygame loop before reading pauses
+CONNECT_TIMEOUT = 10  # seconds for the whole handshake, from resolving to sending metadata
+HAPPY_EYEBALLS_DELAY = 0.25  # seconds before the next address is tried alongside the first
+RECONNECT_DELAY = 0.25  # seconds before the second attempt to reconnect, doubled every time
+RECONNECT_MAX_DELAY = 8
+RECONNECT_GIVE_UP = 60  # seconds of failed attempts before the server counts as gone
+
+
+class AsyncNetwork(Network):
+    """A Network whose socket lives on an asyncio loop in a background thread.
+
+    Connecting, sending and recieving all happen on that loop, so none of
+    them block the pygame loop. Every decoded message is put on
+    `self.messages`, a thread safe queue the pygame loop drains once a frame.
+    A "" on the queue means the server went away, just like Network.recv.
+    The queue is bounded: when the pygame loop falls behind, reading stops
+    and TCP pushes back on the server instead of memory growing. A loop that
+    sleeps while nothing happens sets `on_message` to be woken up, it is
+    called on the network thread after every message is queued.
+
+    With servers that speak "heartbeat" it pings every `heartbeat_interval`
+    seconds, and hangs up when nothing has come for `dead_timeout` seconds.
+
+    A dropped connection is reconnected with exponential backoff. While that
+    goes on the queue gets {"reconnecting": attempt}, then {"reconnected":
+    details} once it worked. Servers with "resume" hand out a session token;
+    showing it again with the number of messages we got lets the server keep
+    the session and replay only what was missed, so details are just
+    {"resumed": True}. Otherwise it is a new session, and details carry the
+    new "id" and the "users" in the lobby. The usual "" only comes when
+    reconnecting has failed for RECONNECT_GIVE_UP seconds.
+    """
+
+    def __init__(
+        self,
+        ip=None,
+        port=None,
+        max_messages=MAX_QUEUED_MESSAGES,
+        heartbeat_interval=HEARTBEAT_INTERVAL,
+        dead_timeout=DEAD_PEER_TIMEOUT,
+        connect_timeout=CONNECT_TIMEOUT,
+    ):
+        self.init_state(ip, port)
+        self.credit_changed = None  # asyncio.Event, set whenever credit comes in
+        self.closed = False
+        self.heartbeat_interval = heartbeat_interval
+        self.dead_timeout = dead_timeout
+
+        # reconnecting
+        self.recieved = 0  # messages recieved in this session, where a replay starts
+        self.online = False  # is there a connection right now?
+        self.closing = False  # close() was called, so don't reconnect
+        self.connect_timeout = connect_timeout
+
+        # decoded messages for the pygame loop
+        self.messages = queue.Queue(maxsize=max_messages)
+        self.on_message = None  # called on the network thread after a message is queued
+        self.stream = None  # asyncio.StreamReader, not the FrameReader of Network
+        self.writer = None
+        self.write_lock = None  # keeps frames from different senders apart
+        self.bulk_lock = None  # one bulk payload at a time, so their chunks never mix
+
+        # the event loop gets a thread of its own for as long as the client runs
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    # run a coroutine on the network loop, returns a concurrent.futures.Future
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    # start connecting without waiting, poll the returned future from the ui
+    def start_connect(self):
+        return self.run(self.connect_async())
+
+    # function to connect to the server, blocks like Network.connect
+    def connect(self):
+        return self.start_connect().result()
+
+    async def connect_async(self):
+        try:
+            data = await asyncio.wait_for(self.open_session(), self.connect_timeout)
+            self.id = data  # the first element in the data will be the id
+
+            self.loop.create_task(self.recieve_forever())
+            self.loop.create_task(self.heartbeat_forever())
+            return data
+        except asyncio.TimeoutError:
+            print("Could not connect to server!")
+            print(f"no answer from {self.server} in {self.connect_timeout}s")
+            return False
+        except Exception as e:
+            print("Could not connect to server!")
+            print("error while trying to connect:", e)
+            return False
+
+    # connect and go through the start of the protocol, returns the id the
+    # server sent. `resume` goes in the metadata when there is a session.
+    async def open_session(self, resume=None):
+        started = time.perf_counter()
+        # every address the name resolves to is tried, IPv4 and IPv6 taking
+        # turns, a new one starting whenever the last has had
+        # HAPPY_EYEBALLS_DELAY to answer, and the first to connect wins
+        self.stream, self.writer = await asyncio.open_connection(
+            *self.addr, happy_eyeballs_delay=HAPPY_EYEBALLS_DELAY, interleave=1
+        )
+        connected = time.perf_counter()
+        self.writer.get_extra_info("socket").setsockopt(
+            socket.IPPROTO_TCP, socket.TCP_NODELAY, 1
+        )
+        self.write_lock = asyncio.Lock()
+        self.bulk_lock = asyncio.Lock()
+        self.credit_changed = asyncio.Event()
+        self.partial, self.credit, self.unacked = {}, {BULK: BULK_WINDOW}, {BULK: 0}
+        print("Connected!")
+
+        # the server sends some initialisation data, so recieve it
+        data = await self.recv_async()
+        if data == "" or data is False:
+            raise ConnectionError("the server closed the connection")
+        got_id = time.perf_counter()
+
+        # the only metadata is the protocol features we can speak
+        metadata = {"features": list(FEATURES)}
+        if resume is not None:
+            metadata["resume"] = resume
+        self.messages_sent += 1
+        await self.send_async(metadata)
+        done = time.perf_counter()
+
+        self.handshake = {
+            "address": self.writer.get_extra_info("peername"),
+            "connect": connected - started,
+            "id": got_id - connected,
+            "metadata": done - got_id,
+            "total": done - started,
+        }
+        print(
+            "handshake with {address[0]} took {total:.3f}s (connect {connect:.3f}s, "
+            "id {id:.3f}s, metadata {metadata:.3f}s)".format(**self.handshake)
+        )
+
+        self.online = True
+        self.last_recieved = time.monotonic()
+        return data
+
+    # try to get the connection back, False once RECONNECT_GIVE_UP seconds
+    # of attempts have failed
+    async def reconnect(self):
+        resume = None
+        if self.session is not None:
+            resume = {"token": self.session, "seq": self.recieved}
+
+        delay = RECONNECT_DELAY
+        give_up = time.monotonic() + RECONNECT_GIVE_UP
+        attempt = 0
+        while not self.closing and time.monotonic() < give_up:
+            attempt += 1
+            await self.queue_message({"reconnecting": attempt})
+            try:
+                id = await asyncio.wait_for(
+                    self.open_session(resume), RECONNECT_MAX_DELAY
+                )
+                details = await asyncio.wait_for(
+                    self.resume_session(id), RECONNECT_MAX_DELAY
+                )
+                await self.queue_message({"reconnected": details})
+                return True
+            except Exception as e:
+                print(f"reconnect attempt {attempt} failed:", e)
+                self.online = False
+                if self.writer:
+                    self.writer.close()
+
+            # wait a bit longer after every failure, spread out so that all
+            # the clients of a restarted server don't come back at once
+            await asyncio.sleep(delay * random.uniform(0.5, 1))
+            delay = min(2 * delay, RECONNECT_MAX_DELAY)
+        return False
+
+    # the first message after the metadata tells if the server kept our session
+    async def resume_session(self, id):
+        while True:
+            data = await self.recv_async()
+            if data == "" or data is False:
+                raise ConnectionError("the server closed the connection")
+            if not self.handle_protocol(data):
+                break
+
+        if isinstance(data, dict) and "resumed" in data:
+            return {"resumed": True}  # the missed messages follow
+
+        # a new session, everything queued for the old one is stale
+        with self.outbox_lock:
+            self.outbox = []
+        self.id = id
+        self.recieved = 1
+        return {"resumed": False, "id": id, "users": data}
+
+    def connection_lost(self):
+        self.online = False
+        self.writer.close()
+        self.credit_changed.set()  # bulk senders waiting for credit give up
+        self.fail_pending(ConnectionError("connection lost"))
+
+    # send some data to the server, waits until it has been handed to the socket.
+    # There is no time limit: a big payload waits for bulk credit for as long
+    # as it takes, and a dead connection ends the wait once the heartbeat
+    # notices it, after dead_timeout. send_later() and flush() don't wait.
+    def send(self, data, pickle_data=True, fn=lambda *args: None, channel=None):
+        self.flush()
+        self.messages_sent += 1
+        sent = self.run(self.send_async(data, pickle_data, channel)).result()
+        if sent:
+            fn(1, 1)
+        return sent
+
+    async def send_async(self, data, pickle_data=True, channel=None):
+        try:
+            if pickle_data:
+                data = pickle.dumps(data)
+
+            if channel is None:
+                channel = INTERACTIVE if pickle_data else BULK
+            if channel != INTERACTIVE and self.has_channels():
+                return await self.send_chunks_async(channel, data, pickle_data)
+
+            return await self.write_buffers(encode_frames(data, pickle_data, self.features))
+
+        except Exception as e:
+            print("error while trying to send data:", e)
+            return False
+
+    # write every queued message in a single syscall, without waiting for it.
+    # While reconnecting they stay queued, and go out once the session is back.
+    def flush(self):
+        if not self.outbox or not self.online:
+            return None
+        with self.outbox_lock:
+            buffers, self.outbox = self.outbox, []
+        return self.run(self.write_buffers(buffers))
+
+    async def write_buffers(self, buffers):
+        try:
+            async with self.write_lock:
+                self.writer.writelines(buffers)
+                self.writes += 1
+                await self.writer.drain()
+            return True
+
+        except Exception as e:
+            print("error while trying to send data:", e)
+            return False
+
+    # send a big payload without waiting for it, returns a Transfer to watch.
+    # Only the bytes from `offset` on are sent, the Transfer counts the rest as done.
+    def send_in_background(self, data, pickle_data=False, channel=BULK, offset=0):
+        if pickle_data:
+            try:
+                data = pickle.dumps(data)
+            except Exception as e:
+                print("error while trying to send data:", e)
+                transfer = Transfer(0)
+                transfer.future = Future()
+                transfer.future.set_result(False)  # nothing went out
+                return transfer
+        rest = memoryview(data)[offset:]
+
+        if channel != INTERACTIVE and self.has_channels():
+            transfer = Transfer(len(data))
+            coro = self.send_chunks_async(channel, rest, pickle_data, transfer)
+        else:
+            buffers = encode_frames(rest, pickle_data, self.features)
+            transfer = Transfer(offset + sum(len(b) for b in buffers))
+            coro = self.send_chunked(buffers, transfer)
+        transfer.sent = offset
+        transfer.future = self.run(coro)
+        return transfer
+
+    # the rest of an offered payload goes in the background here
+    def send_upload(self, data_bytes, offset=0):
+        return self.send_in_background(data_bytes, offset=offset)
+
+    # write whole frames a piece at a time, for servers without channels
+    async def send_chunked(self, buffers, transfer):
+        try:
+            # without channels the server reads the payload in one piece, so
+            # nothing else may go between its chunks: the lock is held for all
+            # of them. Requests don't wait for it, see start_request().
+            async with self.write_lock:
+                for buffer in buffers:
+                    view = memoryview(buffer).cast("B")
+                    for i in range(0, len(view), CHUNK_SIZE):
+                        chunk = view[i : i + CHUNK_SIZE]
+                        self.writer.write(chunk)
+                        self.writes += 1
+                        await self.writer.drain()
+                        transfer.sent += len(chunk)
+            return True
+
+        except Exception as e:
+            print("error while trying to send data:", e)
+            return False
+
+    # send a payload as chunk frames. The write lock is only held for one
+    # chunk, so interactive frames get through in between.
+    async def send_chunks_async(self, channel, data_bytes, pickled=True, transfer=None):
+        try:
+            async with self.bulk_lock:
+                view = memoryview(data_bytes).cast("B")
+                size = len(view)
+                for i in range(0, max(size, 1), CHUNK_SIZE):
+                    chunk = view[i : i + CHUNK_SIZE]
+                    await self.take_credit(channel, len(chunk))
+                    async with self.write_lock:
+                        self.writer.writelines(
+                            chunk_frame(channel, chunk, pickled, i + CHUNK_SIZE >= size)
+                        )
+                        self.writes += 1
+                        await self.writer.drain()
+                    if transfer is not None:
+                        transfer.sent += len(chunk)
+            return True
+
+        except Exception as e:
+            print("error while trying to send data:", e)
+            return False
+
+    async def take_credit(self, channel, n):
+        while self.credit[channel] < n:
+            if not self.online:
+                raise ConnectionError("connection lost")
+            self.credit_changed.clear()
+            await self.credit_changed.wait()
+        self.credit[channel] -= n
+
+    # credit comes in on the network loop, wake up the senders waiting for it
+    def add_credit(self, channel, n):
+        super().add_credit(channel, n)
+        self.credit_changed.set()
+
+    def send_credit(self, channel, n):
+        self.loop.create_task(self.send_async({"credit": (channel, n)}))
+
+    # the request is queued and flushed without waiting for the socket, which
+    # a legacy upload can keep busy for as long as it takes to send
+    def start_request(self, data, reply_key):
+        future, data = self.add_request(data, reply_key)
+        if not self.send_later(data):
+            self.fail_request(future, ConnectionError("could not send the request"))
+        self.flush()
+        return future
+
+    # the reciever thread resolves the Future, so just wait for it
+    def wait_reply(self, future, timeout=REQUEST_TIMEOUT):
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            # not the builtin one before Python 3.11, callers catch the builtin
+            self.forget_request(future)
+            raise TimeoutError(f"no reply to request {future.request_id}") from None
+
+    # the same as request(), for coroutines running on the network loop
+    async def request_async(self, data, reply_key, timeout=REQUEST_TIMEOUT):
+        future, data = self.add_request(data, reply_key)
+        if not await self.send_async(data):
+            self.fail_request(future, ConnectionError("could not send the request"))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            self.forget_request(future)
+            raise TimeoutError(f"no reply to request {future.request_id}") from None
+
+    # take the next message off the queue, blocking until there is one
+    def recv(self, load=True, timeout=None):
+        return self.messages.get(timeout=timeout)
+
+    # readexactly() that counts every read from the socket as word from the
+    # server, so a big frame coming in slowly doesn't look like silence
+    async def read_exactly(self, n):
+        chunks, got = [], 0
+        while got < n:
+            chunk = await self.stream.read(n - got)  # whatever has come in, up to n
+            if not chunk:
+                raise asyncio.IncompleteReadError(b"".join(chunks), n)
+            self.last_recieved = time.monotonic()
+            chunks.append(chunk)
+            got += len(chunk)
+        return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+    async def recv_async(self):
+        try:
+            while True:
+                header = await self.read_exactly(HEADER.size)
+                flags, length = 0, HEADER.unpack(header)[0]
+                if length == LARGE_FRAME:
+                    rest = await self.read_exactly(LARGE_HEADER.size - HEADER.size)
+                    flags, length = LARGE_HEADER.unpack(header + rest)[1:]
+
+                if flags & CHUNK:
+                    (channel,) = CHANNEL.unpack(await self.read_exactly(CHANNEL.size))
+                    chunk = await self.read_exactly(length)
+                    data = self.add_chunk(channel, flags, chunk)
+                    if data is None:
+                        continue  # the rest of the payload comes in later frames
+                else:
+                    data = await self.read_exactly(length)
+
+                if flags & RAW:
+                    return data
+
+                try:
+                    data = pickle.loads(data)
+                except Exception as e:
+                    # the frame was read whole, so the stream is fine: skip it
+                    print("error while decoding a message:", e)
+                    continue
+
+                if isinstance(data, dict) and data.get("message_type") == "huge":
+                    # the batches follow each other on the stream, read them in one go
+                    n_batches = data["n_batches"]
+                    batch_sizes = struct.unpack(
+                        "h" * n_batches, await self.read_exactly(2 * n_batches)
+                    )
+                    return await self.read_exactly(sum(batch_sizes))
+
+                return data
+
+        except asyncio.IncompleteReadError:
+            return ""  # server down
+        except Exception as e:
+            print("error while recieving:", e)
+            return False
+
+    # keep reading messages and queue them up for the pygame loop
+    async def recieve_forever(self):
+        while True:
+            data = await self.recv_async()
+            if self.handle_transport(data):
+                continue
+            if data:
+                self.recieved += 1  # replies count too, the server replays from this number
+                if not self.resolve_request(data):
+                    await self.queue_message(data)
+                continue
+
+            # the connection dropped, get it back if we can
+            self.connection_lost()
+            if not self.closing and await self.reconnect():
+                continue
+            self.closed = True
+            await self.queue_message(data)
+            break
+
+    async def heartbeat_forever(self):
+        while not self.closed:
+            await asyncio.sleep(self.heartbeat_interval)
+            if "heartbeat" not in self.features or not self.online:
+                continue  # older servers don't answer pings, and may be quiet for long
+
+            if self.peer_silent(self.dead_timeout):
+                print(f"no word from the server in {self.dead_timeout}s, hanging up")
+                self.writer.close()  # the reader sees the end of the stream
+                continue
+            await self.send_async(self.next_ping())
+
+    def send_pong(self, number):
+        self.loop.create_task(self.send_async({"pong": number}))
+
+    # wait for room on the queue without blocking the event loop
+    async def queue_message(self, data):
+        while True:
+            try:
+                self.messages.put_nowait(data)
+            except queue.Full:
+                await asyncio.sleep(0.005)
+                continue
+            if self.on_message:
+                self.on_message()
+            return
+
+    def close(self):
+        self.closing = True
+        self.run(self.shutdown())
+
+    # stop every task of this connection, then the loop itself
+    async def shutdown(self):
+        if self.writer:
+            self.writer.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.loop.stop()
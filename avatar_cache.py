@@ -0,0 +1,122 @@
+import os
+import string
+import threading
+from collections import OrderedDict
+import numpy as np
+
+AVATAR_CACHE_DIR = "avatar_cache"  # next to saved_settings.json
+AVATAR_CACHE_BYTES = 64 * 1024 * 1024  # about 340 decoded 256x256 avatars
+
+
+class AvatarCache:
+    """Decoded avatars on disk, named by the hash the server gives them.
+
+    Servers with "avatar_hashes" send a user's "image_hash" instead of the
+    image, so an avatar seen in an earlier session (or before a reconnect)
+    is loaded from here without being transferred or decoded again. Files
+    hold the array3d of the avatar. When they take more than max_bytes the
+    least recently used ones are deleted, the file times keep that order
+    across restarts. The avatar decoding threads use it too, so the index
+    is only touched under a lock.
+    """
+
+    def __init__(self, path=AVATAR_CACHE_DIR, max_bytes=AVATAR_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.files = OrderedDict()  # hash -> size, least recently used first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            entries = [e for e in os.scandir(self.path) if e.is_file()]
+        except OSError as e:
+            print("avatar cache disabled:", e)
+            self.path = None
+            return
+
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            if entry.name.endswith(".tmp"):
+                os.remove(entry.path)  # left over from a crash mid write
+                continue
+            self.files[entry.name] = entry.stat().st_size
+            self.size += entry.stat().st_size
+
+    # hashes become file names, so only plain hex ones are used
+    @staticmethod
+    def valid(hash):
+        return (
+            isinstance(hash, str)
+            and 0 < len(hash) <= 128
+            and all(c in string.hexdigits for c in hash)
+        )
+
+    def file(self, hash):
+        return os.path.join(self.path, hash)
+
+    def __contains__(self, hash):
+        return self.path is not None and hash in self.files
+
+    def get(self, hash):
+        """The array3d of a cached avatar, or None."""
+        with self.lock:
+            return self._get(hash)
+
+    def _get(self, hash):
+        if hash not in self:
+            self.misses += 1
+            return None
+        try:
+            with open(self.file(hash), "rb") as f:
+                image = np.load(f, allow_pickle=False)
+            os.utime(self.file(hash))
+        except (OSError, ValueError) as e:
+            print("dropping broken avatar cache file:", hash, e)
+            self.remove(hash)
+            self.misses += 1
+            return None
+
+        self.files.move_to_end(hash)
+        self.hits += 1
+        return image
+
+    def put(self, hash, image):
+        """Keep the array3d of an avatar under its hash."""
+        with self.lock:
+            self._put(hash, image)
+
+    def _put(self, hash, image):
+        if self.path is None or not self.valid(hash) or hash in self.files:
+            return
+        tmp = self.file(hash) + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                np.save(f, np.ascontiguousarray(image), allow_pickle=False)
+            os.replace(tmp, self.file(hash))
+            size = os.path.getsize(self.file(hash))
+        except OSError as e:
+            print("could not cache avatar:", e)
+            return
+
+        self.files[hash] = size
+        self.size += size
+        while self.size > self.max_bytes and len(self.files) > 1:
+            self.remove(next(iter(self.files)))
+
+    def remove(self, hash):
+        with self.lock:
+            self.size -= self.files.pop(hash, 0)
+            try:
+                os.remove(self.file(hash))
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            "files": len(self.files),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
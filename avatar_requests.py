@@ -0,0 +1,54 @@
+from collections import OrderedDict
+
+# avatars kept as surfaces: a page on screen, the next one, the profile, and
+# some slack so flipping back and forth doesn't fetch them all again
+MAX_LOADED_AVATARS = 40
+
+
+class AvatarRequests:
+    """Keeps track of which avatars the client should ask the server for.
+
+    Servers with "avatar_requests" send users without their image, marked
+    with "has_image". The client then asks for the avatars of the users it
+    is about to show, and only the last MAX_LOADED_AVATARS of them are kept,
+    so memory and bandwidth follow what is on screen, not the lobby size.
+    """
+
+    def __init__(self, max_loaded=MAX_LOADED_AVATARS):
+        self.max_loaded = max_loaded
+        self.requested = set()  # ids asked for, whose image hasn't come yet
+        self.loaded = OrderedDict()  # ids with an image, least recently wanted first
+        self.wanted = set()  # ids on screen or about to be, never dropped
+
+    def want(self, ids):
+        """Mark these ids as needed, return the ones that still have to be asked for."""
+        self.wanted = set(ids)
+        missing = []
+        for id in ids:
+            if id in self.loaded:
+                self.loaded.move_to_end(id)
+            elif id not in self.requested:
+                self.requested.add(id)
+                missing.append(id)
+        return missing
+
+    def recieved(self, id):
+        """Note that an avatar came, return the ids whose image should be dropped now."""
+        self.requested.discard(id)
+        self.loaded[id] = True
+        self.loaded.move_to_end(id)
+
+        evicted = []
+        for old in list(self.loaded):
+            if len(self.loaded) <= self.max_loaded:
+                break
+            if old in self.wanted or old == id:
+                continue
+            del self.loaded[old]
+            evicted.append(old)
+        return evicted
+
+    def forget(self, id):
+        """The user left or changed their image, ask again next time they are shown."""
+        self.requested.discard(id)
+        self.loaded.pop(id, None)
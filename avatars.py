@@ -0,0 +1,156 @@
+import io, zlib, queue, threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pygame
+
+AVATAR_WORKERS = 2  # threads decoding and scaling avatars
+PROFILE_BG_ALPHA = 50  # how see-through an avatar is behind its profile
+
+# Ways an avatar can travel, best first, with the protocol feature that
+# turns each one on. "raw" is the array3d bytes every server understands.
+AVATAR_ENCODINGS = {"png": "png_avatars", "zlib": "zlib_avatars"}
+
+
+# Function to choose the best encoding the server agreed to
+def pick_encoding(features):
+    for encoding, feature in AVATAR_ENCODINGS.items():
+        if feature in features:
+            return encoding
+    return "raw"
+
+
+# Function to turn an array3d image into the bytes that are sent
+def encode_avatar(img, encoding="raw"):
+    if encoding == "png":
+        f = io.BytesIO()
+        pygame.image.save(pygame.surfarray.make_surface(img), f, "avatar.png")
+        return f.getvalue()
+    if encoding == "zlib":
+        return zlib.compress(img.tobytes(), 6)
+    return img.tobytes()
+
+
+# Function to turn recieved avatar bytes back into a surface,
+# details is the image message that announced them
+def decode_avatar(data, details):
+    encoding = details.get("encoding", "raw")
+    if encoding == "png":
+        return pygame.image.load(io.BytesIO(data), "avatar.png")
+    if encoding == "zlib":
+        data = zlib.decompress(data)
+    image = np.frombuffer(data, dtype=details["dtype"]).reshape(*details["shape"])
+    return pygame.surfarray.make_surface(image)
+
+
+class PreparedAvatar:
+    """An avatar made ready to blit: the decoded surface, the copy scaled
+    to the user buttons with the text color that reads well on it, and the
+    faded profile background if a profile was open for it."""
+
+    def __init__(self, surface, button_image, avg_color, profile_image=None):
+        self.surface = surface
+        self.button_image = button_image
+        self.avg_color = avg_color
+        self.text_color = [255 - c for c in avg_color]
+        self.profile_image = profile_image
+
+
+# Function to scale an avatar for a button and work out the average color
+# under its text, text_size is the size of the rendered username
+def prepare_avatar(surface, button_size, text_size, profile_size=None):
+    w, h = int(button_size[0]), int(button_size[1])
+    button_image = pygame.transform.scale(surface, (w, h))
+
+    text_rect = pygame.Rect((0, 0), text_size)
+    text_rect.center = (w // 2, h // 2)
+    text_rect = text_rect.clip(button_image.get_rect())
+    if text_rect.width and text_rect.height:
+        arr = pygame.surfarray.array3d(button_image.subsurface(text_rect))
+        avg_color = np.round(arr.reshape(-1, 3).mean(axis=0)).astype(np.int64)
+    else:
+        avg_color = np.round(pygame.transform.average_color(button_image)[:3]).astype(np.int64)
+
+    profile_image = None
+    if profile_size is not None:
+        profile_image = pygame.transform.scale(
+            surface, (int(profile_size[0]), int(profile_size[1])))
+        profile_image.set_alpha(PROFILE_BG_ALPHA)
+
+    return PreparedAvatar(surface, button_image, avg_color, profile_image)
+
+
+class AvatarDecoder:
+    """Decodes and prepares avatars on a few worker threads.
+
+    submit() takes a function that loads the surface (from recieved bytes or
+    the disk cache) and the sizes to prepare it for. The pygame loop picks
+    up the PreparedAvatars with finished(), so all it does per avatar is
+    swap the surfaces in. A load that returns None is handed back as None.
+    Only the last avatar submitted for a user is handed back. on_ready, if
+    given, is called on the worker thread every time one is done.
+    """
+
+    def __init__(self, workers=AVATAR_WORKERS, on_ready=None):
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="avatars")
+        self.on_ready = on_ready
+        self.results = queue.Queue()
+        self.latest = {}  # user id -> number of their last submitted avatar
+        self.lock = threading.Lock()
+        self.submitted = 0
+
+    def submit(self, user_id, load, button_size, text_size, profile_size=None):
+        with self.lock:
+            self.submitted += 1
+            number = self.latest[user_id] = self.submitted
+        self.pool.submit(
+            self.prepare, user_id, number, load, button_size, text_size, profile_size
+        )
+
+    def prepare(self, user_id, number, load, button_size, text_size, profile_size):
+        with self.lock:
+            if self.latest.get(user_id) != number:
+                return  # replaced or dropped before its turn came
+        try:
+            surface = load()
+            avatar = None
+            if surface is not None:
+                avatar = prepare_avatar(surface, button_size, text_size, profile_size)
+        except Exception as e:
+            print("could not decode avatar of user", user_id, e)
+            return
+        self.results.put((user_id, number, avatar))
+        if self.on_ready:
+            self.on_ready()
+
+    # the avatars that are ready, as (user id, PreparedAvatar or None)
+    def finished(self):
+        ready = []
+        while True:
+            try:
+                user_id, number, avatar = self.results.get_nowait()
+            except queue.Empty:
+                return ready
+            with self.lock:
+                if self.latest.get(user_id) != number:
+                    continue  # a newer one is on its way
+                del self.latest[user_id]
+            ready.append((user_id, avatar))
+
+    # is an avatar for this user on its way?
+    def preparing(self, user_id):
+        with self.lock:
+            return user_id in self.latest
+
+    def forget(self, user_id):
+        with self.lock:
+            self.latest.pop(user_id, None)
+
+    # drop everything that is still on its way
+    def clear(self):
+        with self.lock:
+            self.latest.clear()
+
+    # stop the threads, the avatars still waiting for one are skipped
+    def close(self):
+        self.clear()
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,93 @@
+# Time the main thread spends per avatar: decoding, scaling and measuring
+# it inline like before, against swapping in one that the AvatarDecoder
+# threads prepared.
+#
+#   python benchmarks/bench_avatar_decode.py [avatars]
+import os
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # constants loads the static files relative to the repo
+
+import numpy as np
+from avatars import AvatarDecoder, decode_avatar, encode_avatar
+from constants import Button_Styles, LEFT_WIDTH, HEIGHT
+from utilities import UserButton_Container, Profile
+
+
+def make_lobby(n):
+    container = UserButton_Container()
+    profiles = {}
+    for i in range(n):
+        user = {"id": i, "username": f"user{i}", "color": (i % 255, 100, 100)}
+        container.add_user_button(user, False, print, refresh=False)
+        profiles[i] = Profile(user, False, print, print)
+    return container, profiles
+
+
+def avatars(n):
+    rng = np.random.default_rng(1)
+    details = {"shape": (256, 256, 3), "dtype": "uint8", "encoding": "zlib"}
+    images = [
+        encode_avatar(rng.integers(0, 255, (256, 256, 3), dtype=np.uint8), "zlib")
+        for _ in range(n)
+    ]
+    return images, details
+
+
+def inline(n):
+    container, profiles = make_lobby(n)
+    images, details = avatars(n)
+    t = time.perf_counter()
+    for i, data in enumerate(images):
+        surf = decode_avatar(data, details)
+        container.update_button(i, {"image": surf})
+        profiles[i].update(changed={"image": surf})
+    return time.perf_counter() - t, time.perf_counter() - t
+
+
+def pooled(n):
+    container, profiles = make_lobby(n)
+    images, details = avatars(n)
+    decoder = AvatarDecoder()
+    text_size = Button_Styles.USER_BUTTON_STYLE["font"].size("user0")
+    button_size = (container.user_button_w, container.user_button_h)
+
+    t = time.perf_counter()
+    main_thread = 0
+    for i, data in enumerate(images):
+        start = time.perf_counter()
+        decoder.submit(
+            i,
+            lambda data=data: decode_avatar(data, details),
+            button_size,
+            text_size,
+            (LEFT_WIDTH, HEIGHT),
+        )
+        main_thread += time.perf_counter() - start
+
+    applied = 0
+    while applied < n:
+        start = time.perf_counter()
+        for user_id, avatar in decoder.finished():
+            container.set_avatar(user_id, avatar)
+            profiles[user_id].set_background(avatar.profile_image)
+            applied += 1
+        main_thread += time.perf_counter() - start
+        time.sleep(0.001)
+    decoder.close()
+    return main_thread, time.perf_counter() - t
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    for name, fn in (("inline", inline), ("worker pool", pooled)):
+        main_thread, total = fn(n)
+        print(
+            f"{name:12}: {main_thread / n * 1000:.2f} ms/avatar on the main thread, "
+            f"{total:.2f} s for {n} avatars"
+        )
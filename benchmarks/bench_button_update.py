@@ -0,0 +1,76 @@
+# Time Button.update for the buttons of a few screens: the 13 Connect4
+# column buttons, the 4 navigation buttons and a lobby page with avatars.
+# Once with every look drawn from scratch each frame like before, once
+# blitting the cached surface of the look.
+#
+#   python benchmarks/bench_button_update.py [frames]
+import os
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # constants loads the static files relative to the repo
+
+import numpy as np
+import pygame
+from constants import WIDTH, HEIGHT
+
+pygame.display.set_mode((WIDTH, HEIGHT))  # the coin images need a display to convert to
+
+import button
+from utilities import Connect4_Board, Navigators, UserButton_Container
+
+
+def screens():
+    board = Connect4_Board(1, 1, 2)
+    # hovering over one column, the next one can't be played
+    board.top_bar_buttons[3].hovered = True
+    board.top_bar_buttons[4].disable()
+
+    navigators = Navigators(print, print, print, print)
+    navigators.update_buttons(0, ["home", "game"])
+
+    lobby = UserButton_Container()
+    rng = np.random.default_rng(1)
+    size = (int(lobby.user_button_w), int(lobby.user_button_h))
+    for i in range(lobby.rows * lobby.cols):
+        # avatars come scaled to the button already
+        image = pygame.surfarray.make_surface(
+            rng.integers(0, 255, (*size, 3), dtype=np.uint8)
+        )
+        user = {"id": i, "username": f"user{i}", "color": (i * 20, 100, 100), "image": image}
+        lobby.add_user_button(user, i == 0, print, refresh=False)
+    lobby.refresh()
+    user_buttons = [b.button for b in lobby.user_buttons.values()]
+
+    return [
+        ("connect4 columns", board.top_bar_buttons, board.surf),
+        ("navigation", navigators.buttons, navigators.surf),
+        ("lobby page", user_buttons, lobby.surf),
+    ]
+
+
+def run(buttons, surf, frames):
+    t = time.perf_counter()
+    for _ in range(frames):
+        for b in buttons:
+            b.update(surf)
+    return (time.perf_counter() - t) / (frames * len(buttons))
+
+
+if __name__ == "__main__":
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    cached_get = button.button_surfaces.get
+    for name, buttons, surf in screens():
+        button.button_surfaces.get = lambda key: None  # draw every look again
+        uncached = run(buttons, surf, frames)
+        button.button_surfaces.get = cached_get
+        cached = run(buttons, surf, frames)
+        print(
+            f"{name:17}: {uncached * 1e6:7.1f} us/button drawn, "
+            f"{cached * 1e6:6.1f} us/button cached, {uncached / cached:5.1f}x"
+        )
+    print(button.button_surfaces.stats())
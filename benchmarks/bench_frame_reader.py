@@ -0,0 +1,80 @@
+# Compares the syscalls and the time needed to recieve a burst of frames with
+# the old two-recv-per-message path and with the buffered FrameReader, for a
+# few frame sizes. Only the framing is timed, unpickling costs the same on
+# both paths. Each time is the best of REPEATS runs.
+#
+#   python benchmarks/bench_frame_reader.py
+import os
+import sys
+import time
+import socket
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from network import HEADER, FrameReader
+
+N_MESSAGES = 20000
+REPEATS = 9
+# a move is about 70 bytes pickled, a lobby update a few hundred
+SIZES = (16, 70, 256, 1024, 4096)
+
+
+def make_stream(n, size):
+    body = bytes(size)
+    return (HEADER.pack(size) + body) * n
+
+
+def feed(sock, stream):
+    sock.sendall(stream)
+    sock.shutdown(socket.SHUT_WR)
+
+
+def old_path(sock, n):
+    # what Network.recv did before: one recv for the header, one for the body
+    syscalls = 0
+    for _ in range(n):
+        length = HEADER.unpack(sock.recv(2))[0]
+        syscalls += 1
+        body = sock.recv(length)
+        syscalls += 1
+        while len(body) < length:  # the old code did not do this, and broke
+            body += sock.recv(length - len(body))
+            syscalls += 1
+    return syscalls
+
+
+def new_path(sock, n):
+    reader = FrameReader(sock)
+    for _ in range(n):
+        reader.read_frame()
+        reader.end_frame()
+    return reader.syscalls
+
+
+def run(fn, stream):
+    best = None
+    for _ in range(REPEATS):
+        a, b = socket.socketpair()
+        writer = threading.Thread(target=feed, args=(a, stream))
+        writer.start()
+        t = time.perf_counter()
+        syscalls = fn(b, N_MESSAGES)
+        elapsed = time.perf_counter() - t
+        writer.join()
+        a.close()
+        b.close()
+        best = elapsed if best is None else min(best, elapsed)
+    return syscalls, best
+
+
+if __name__ == "__main__":
+    print(f"{N_MESSAGES} frames per run, best of {REPEATS}")
+    print(f"{'bytes':>6} {'old syscalls':>13} {'old ms':>7} {'new syscalls':>13} {'new ms':>7}")
+    for size in SIZES:
+        stream = make_stream(N_MESSAGES, size)
+        old_syscalls, old_elapsed = run(old_path, stream)
+        new_syscalls, new_elapsed = run(new_path, stream)
+        print(
+            f"{size:>6} {old_syscalls:>13} {old_elapsed * 1000:>7.1f} "
+            f"{new_syscalls:>13} {new_elapsed * 1000:>7.1f}"
+        )
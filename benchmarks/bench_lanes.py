@@ -0,0 +1,89 @@
+# Round trip time of moves while profile images are being uploaded, with
+# every payload on one stream and with a separate bulk channel.
+#
+#   python benchmarks/bench_lanes.py
+import os
+import sys
+import time
+import socket
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from network import FrameReader, Network
+from async_network import AsyncNetwork
+
+IMAGE_BYTES = 256 * 256 * 3  # a raw array3d avatar
+IMAGES = 40
+LINK_SPEED = 8 * 1024 * 1024  # bytes per second the server reads, like a slow link
+
+
+class SlowSocket:
+    # reads at most LINK_SPEED bytes a second, the rest waits in the kernel
+    def __init__(self, sock):
+        self.sock = sock
+
+    def recv_into(self, view):
+        n = self.sock.recv_into(view[: 16 * 1024])
+        time.sleep(n / LINK_SPEED)
+        return n
+
+
+def echo_server(features):
+    # answers every move straight away and throws the images away
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+
+    def serve():
+        sock, _ = listener.accept()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        peer = Network("", 0)
+        peer.client, peer.reader = sock, FrameReader(SlowSocket(sock))
+        peer.send(1)
+        peer.recv_frame()  # the client's features
+        peer.send({"features": features})
+        peer.features = set(features)
+        while True:
+            data = peer.recv()
+            if not data:
+                break
+            if isinstance(data, dict) and "move" in data:
+                peer.send({"moved": data["move"]})
+        sock.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def run(features):
+    n = AsyncNetwork("127.0.0.1", echo_server(features))
+    n.connect()
+    while n.features != set(features):
+        time.sleep(0.01)
+
+    payload = os.urandom(IMAGE_BYTES)
+    transfers = [n.send_in_background(payload) for _ in range(IMAGES)]
+    # only moves made while the images are still going up count
+    times = []
+    while not transfers[-1].done:
+        t = time.perf_counter()
+        n.send({"move": len(times)})
+        n.recv()
+        times.append(time.perf_counter() - t)
+        time.sleep(0.01)
+    n.close()
+
+    times.sort()
+    return len(times), times[len(times) // 2], times[int(len(times) * 0.95)], times[-1]
+
+
+if __name__ == "__main__":
+    for name, features in (
+        ("one stream", ["large_frames"]),
+        ("bulk channel", ["large_frames", "channels"]),
+    ):
+        moves, p50, p95, worst = run(features)
+        print(
+            f"{name:12}: {moves} moves, round trip p50 {p50 * 1000:.2f} ms, "
+            f"p95 {p95 * 1000:.2f} ms, max {worst * 1000:.2f} ms"
+        )
@@ -0,0 +1,58 @@
+# Times the transfer of a profile image sized payload with the old 1 KiB
+# "huge" batches and with a single large frame.
+#
+#   python benchmarks/bench_large_frames.py
+import os
+import sys
+import time
+import socket
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from network import FrameReader, Network
+
+IMAGE_BYTES = 256 * 256 * 3  # a raw array3d avatar
+ROUNDS = 50
+
+
+def connected_pair():
+    a, b = socket.socketpair()
+    sender, reciever = Network("", 0), Network("", 0)
+    sender.client, reciever.client = a, b
+    reciever.reader = FrameReader(b)
+    return sender, reciever
+
+
+def run(large):
+    sender, reciever = connected_pair()
+    if large:
+        sender.features.add("large_frames")
+    payload = os.urandom(IMAGE_BYTES)
+    writes = [0]
+
+    def count(*args):
+        writes[0] += 1
+
+    def send_all():
+        for _ in range(ROUNDS):
+            sender.send(payload, pickle_data=False, fn=count)
+
+    writer = threading.Thread(target=send_all)
+    t = time.perf_counter()
+    writer.start()
+    for _ in range(ROUNDS):
+        assert len(reciever.recv(load=False)) == IMAGE_BYTES
+    elapsed = time.perf_counter() - t
+    writer.join()
+    sender.client.close()
+    reciever.client.close()
+    return elapsed, writes[0], reciever.reader.syscalls
+
+
+if __name__ == "__main__":
+    for name, large in (("1 KiB batches", False), ("large frame", True)):
+        elapsed, writes, reads = run(large)
+        print(
+            f"{name:14}: {elapsed / ROUNDS * 1000:.2f} ms per image, "
+            f"{writes / ROUNDS:.0f} progress callbacks, {reads / ROUNDS:.1f} recvs"
+        )
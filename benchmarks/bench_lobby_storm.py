@@ -0,0 +1,138 @@
+# Replays a connect/disconnect storm into the lobby widgets, once message by
+# message like before and once through LobbyUpdates with one layout pass per
+# frame.
+#
+#   python benchmarks/bench_lobby_storm.py [users] [per-message users]
+#
+# The per-message replay is quadratic, so by default it only replays the
+# first 1000 users of the storm.
+import os
+import sys
+import time
+import random
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # constants loads the static files relative to the repo
+
+from constants import Colors, Fonts
+from utilities import UserButton_Container
+from lobby_updates import LobbyUpdates
+
+MESSAGES_PER_FRAME = 200  # roughly what the message budget gets through
+
+
+def storm(n_users, seed=1):
+    rng = random.Random(seed)
+    users = [
+        {"id": i, "username": f"user{i}", "color": (i % 255, 100, 100)}
+        for i in range(1, n_users + 1)
+    ]
+    messages = [{"connected": u} for u in users]
+    for u in rng.sample(users, n_users // 10):
+        messages.append(
+            {"updated": {"user_id": u["id"], "changed": {"username": "renamed"}}}
+        )
+    leaving = rng.sample(users, n_users)
+    messages += [{"disconnected": u["id"]} for u in leaving]
+    return messages
+
+
+# The lobby as it was before LobbyUpdates: the counters rendered again after
+# every change, and every removal rebuilding each button in its new slot
+def old_refresh(container):
+    container.num_users_text = Fonts.notification_font.render(
+        str(container.num_users), False, Colors.WHITE
+    )
+    container.update_pagination()
+    container.page_render = Fonts.notification_font.render(
+        f"{container.current_page+1}/{len(container.user_buttons_list)}", True, Colors.GRAY,
+    )
+
+
+def old_remove_user_button(container, id):
+    btn = container.user_buttons.pop(id)
+    container.user_buttons_list[btn.page][btn.row].pop(btn.col)
+    container.num_users -= 1
+
+    all_buttons = [b for page in container.user_buttons_list for row in page for b in row]
+    container.user_buttons_list = [[[]]]
+    for b in all_buttons:
+        if len(container.user_buttons_list[-1][-1]) >= container.cols:
+            container.add_row()
+        container.user_buttons_list[-1][-1].append(b)
+        row = len(container.user_buttons_list[-1]) - 1
+        col = len(container.user_buttons_list[-1][-1]) - 1
+        b.update(
+            {
+                "page": len(container.user_buttons_list) - 1,
+                "row": row,
+                "col": col,
+                "rect": (
+                    col * (container.user_button_w + container.user_button_gap)
+                    + container.user_button_gap,
+                    container.title_rect.height
+                    + row * (container.user_button_h + container.user_button_gap)
+                    + container.user_button_gap,
+                    container.user_button_w,
+                    container.user_button_h,
+                ),
+            }
+        )
+    if container.current_page >= len(container.user_buttons_list):
+        container.current_page = len(container.user_buttons_list) - 1
+    old_refresh(container)
+
+
+def per_message(messages):
+    container = UserButton_Container()
+    for data in messages:
+        if data.get("connected"):
+            container.add_user_button(data["connected"], False, print, refresh=False)
+            old_refresh(container)
+        if data.get("disconnected"):
+            old_remove_user_button(container, data["disconnected"])
+        if data.get("updated"):
+            container.update_button(
+                data["updated"]["user_id"], data["updated"]["changed"]
+            )
+    return container
+
+
+def coalesced(messages):
+    container = UserButton_Container()
+    updates = LobbyUpdates()
+    for start in range(0, len(messages), MESSAGES_PER_FRAME):
+        for data in messages[start : start + MESSAGES_PER_FRAME]:
+            updates.add(data)
+
+        removed, added, changed = updates.flush()
+        container.remove_user_buttons(removed)
+        for user in added:
+            container.add_user_button(user, False, print, refresh=False)
+        container.refresh()
+        for id, user_changes in changed.items():
+            container.update_button(id, user_changes)
+    return container
+
+
+def run(name, fn, messages):
+    t = time.perf_counter()
+    container = fn(messages)
+    elapsed = time.perf_counter() - t
+    assert container.num_users == 0
+    print(
+        f"{name:12}: {len(messages)} messages in {elapsed:.2f} s "
+        f"({elapsed / len(messages) * 1e6:.0f} us/message)"
+    )
+
+
+if __name__ == "__main__":
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    n_old = int(sys.argv[2]) if len(sys.argv) > 2 else min(n_users, 1000)
+
+    # users leave in a random order, so removals hit every page
+    run("coalesced", coalesced, storm(n_users))
+    run("per message", per_message, storm(n_old))
@@ -0,0 +1,128 @@
+# Write syscalls and round trip of small messages: the old path (header and
+# body in two sendall calls, Nagle left on), one sendmsg per message, and
+# every message of a frame batched into one write.
+#
+#   python benchmarks/bench_send_syscalls.py
+import os
+import sys
+import time
+import socket
+import struct
+import pickle
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from network import FrameReader, Network
+
+FPS = 60
+FRAMES = 600
+# what one busy frame sends: a challenge answer, a settings update and a move
+FRAME_MESSAGES = [
+    {"accepted": {"player1_id": 3, "player2_id": 7, "game": "connect4"}},
+    {"updated": {"username": "someone"}},
+    {"move": {"game_id": 12, "move": (3, 4)}},
+]
+ROUND_TRIPS = 20
+
+
+class CountingSocket:
+    # a socket that counts the syscalls made to write to it
+    def __init__(self, sock):
+        self.sock = sock
+        self.writes = 0
+
+    def sendall(self, data):
+        self.writes += 1
+        return self.sock.sendall(data)
+
+    def sendmsg(self, buffers):
+        self.writes += 1
+        return self.sock.sendmsg(buffers)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+def old_send(network, data):
+    # Network.send before the header and body were written together
+    data = pickle.dumps(data)
+    network.client.sendall(struct.pack("h", len(data)))
+    network.client.sendall(data)
+
+
+def new_send(network, data):
+    network.send(data)
+
+
+def batched_send(network, data):
+    network.send_later(data)
+
+
+def drain(sock):
+    while sock.recv(1 << 16):
+        pass
+
+
+def count_writes(send):
+    a, b = socket.socketpair()
+    threading.Thread(target=drain, args=(b,), daemon=True).start()
+    sender = Network("", 0)
+    sender.client = CountingSocket(a)
+
+    t = time.perf_counter()
+    for _ in range(FRAMES):
+        for message in FRAME_MESSAGES:
+            send(sender, message)
+        sender.flush()
+    elapsed = time.perf_counter() - t
+    a.close()
+    return sender.client.writes, elapsed
+
+
+def round_trip(send, nodelay):
+    # an echo server that answers with a single write straight away
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+
+    def serve():
+        sock, _ = listener.accept()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        peer = Network("", 0)
+        peer.client, peer.reader = sock, FrameReader(sock)
+        while True:
+            data = peer.recv()
+            if not data:
+                break
+            peer.send(data)
+        sock.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    client = Network("", 0)
+    client.client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(nodelay))
+    client.client.connect(listener.getsockname())
+
+    times = []
+    for i in range(ROUND_TRIPS):
+        t = time.perf_counter()
+        send(client, {"move": {"game_id": 12, "move": i}})
+        client.flush()
+        client.recv()
+        times.append(time.perf_counter() - t)
+    client.client.close()
+    times.sort()
+    return times[len(times) // 2]
+
+
+if __name__ == "__main__":
+    for name, send, nodelay in (
+        ("two sendall, Nagle", old_send, False),
+        ("one sendmsg", new_send, True),
+        ("batched per frame", batched_send, True),
+    ):
+        writes, elapsed = count_writes(send)
+        rtt = round_trip(send, nodelay)
+        print(
+            f"{name:18}: {writes / FRAMES * FPS:.0f} send syscalls/s at {FPS} fps, "
+            f"{elapsed / FRAMES * 1e6:.1f} us per frame, move round trip {rtt * 1000:.2f} ms"
+        )
@@ -0,0 +1,60 @@
+# Fit long usernames and notification texts into their widgets, once taking
+# off a character at a time like before, once with fit_text: with nothing
+# measured yet, and again when the same buttons are rebuilt.
+#
+#   python benchmarks/bench_text_fit.py [texts]
+import os
+import sys
+import time
+import random
+import string
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # constants loads the static files relative to the repo
+
+from constants import Fonts
+import text_fit
+from text_fit import fit_text
+
+
+def one_at_a_time(font, text, width):
+    if font.size(text)[0] > width:
+        while text and font.size(text + "...")[0] > width:
+            text = text[:-1]
+        text += "..."
+    return text
+
+
+def texts(n, seed=1):
+    rng = random.Random(seed)
+    chars = string.ascii_letters + string.digits + " _-"
+    for _ in range(n):
+        yield "".join(rng.choice(chars) for _ in range(rng.randint(5, 120)))
+
+
+def run(fit, cases):
+    t = time.perf_counter()
+    results = [fit(font, text, width) for font, text, width in cases]
+    return time.perf_counter() - t, results
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    fonts = [Fonts.user_font, Fonts.notification_font, Fonts.subtitle_font]
+    cases = [
+        (fonts[i % len(fonts)], text, 150 + i % 5 * 50)
+        for i, text in enumerate(texts(n))
+    ]
+
+    before, expected = run(one_at_a_time, cases)
+    cold, results = run(fit_text, cases)
+    assert results == expected, "fit_text cut a text differently"
+    warm, _ = run(fit_text, cases)
+
+    print(f"one at a time : {before / n * 1e6:7.1f} us/text")
+    print(f"fit_text      : {cold / n * 1e6:7.1f} us/text ({before / cold:.1f}x)")
+    print(f"fit_text again: {warm / n * 1e6:7.1f} us/text ({before / warm:.1f}x)")
+    print(len(text_fit.fitted), "fitted texts remembered")
@@ -1,5 +1,17 @@
 import pygame as pg
 from constants import *
+from dirty_rects import dirty_rects
+from surface_cache import SurfaceCache, surface_bytes
+from text_cache import cached_render
+from text_fit import fit_text
+
+# Fully drawn buttons, by everything they are drawn from. Buttons drawn from
+# the same surfaces and colors share one.
+BUTTON_CACHE_BYTES = 16 * 1024 * 1024
+button_surfaces = SurfaceCache(BUTTON_CACHE_BYTES)
+
+# One font for all buttons that don't bring their own, so their texts share renders
+DEFAULT_FONT = pg.font.Font(None, 16)
 
 # Modified button class picked up from a great github repo...
 class Button(object):
@@ -31,7 +43,7 @@ class Button(object):
     def process_kwargs(self, kwargs):
         """Various optional customization you can change by passing kwargs."""
         settings = {
-            "font": pg.font.Font(None, 16),
+            "font": DEFAULT_FONT,
             "text": None,
             "call_on_release": True,
             "hover_color": None,
@@ -51,13 +63,9 @@ class Button(object):
 
         for kwarg in kwargs:
             if kwarg == "text" and self.truncate:
-                if settings["font"].size(kwargs["text"])[0] > self.rect.width:
-                    while (
-                        settings["font"].size(kwargs["text"] + "...")[0]
-                        > self.rect.width
-                    ):
-                        kwargs["text"] = kwargs["text"][:-1]
-                    kwargs["text"] += "..."
+                kwargs["text"] = fit_text(
+                    settings["font"], kwargs["text"], self.rect.width
+                )
 
             settings[kwarg] = kwargs[kwarg]
 
@@ -67,7 +75,7 @@ class Button(object):
         x, y = self.rect.x +5, self.rect.y +5
         font = Fonts.small_font
         for tag in self.tags:
-            text_surf = font.render(tag, True, Colors.BLACK)
+            text_surf = cached_render(font, tag, True, Colors.BLACK)
             rect = text_surf.get_rect(topleft=(x, y))
             x += rect.width + 10
             self.tag_surfs.append((text_surf, rect))
@@ -77,22 +85,24 @@ class Button(object):
 
         if self.text:
             if self.disabled:
-                self.rendered_text = self.font.render(
-                    self.text, True, self.disabled_text_color
+                self.rendered_text = cached_render(
+                    self.font, self.text, True, self.disabled_text_color
                 )
 
             else:
                 if self.hover_font_color:
                     color = self.hover_font_color
-                    self.hover_text = self.font.render(self.text, True, color)
+                    self.hover_text = cached_render(self.font, self.text, True, color)
                 if self.clicked_font_color:
                     color = self.clicked_font_color
-                    self.clicked_text = self.font.render(self.text, True, color)
-                self.rendered_text = self.font.render(self.text, True, self.font_color)
+                    self.clicked_text = cached_render(self.font, self.text, True, color)
+                self.rendered_text = cached_render(self.font, self.text, True, self.font_color)
 
     def check_event(self, event, **kwargs):
         """The button needs to be passed events from your program event loop."""
         if self.disabled:
+            if self.clicked or self.hovered:
+                self.mark_dirty()
             self.clicked = False
             self.hovered = False
 
@@ -106,12 +116,14 @@ class Button(object):
     def on_click(self, event, **kwargs):
         if self.real_rect and self.real_rect.collidepoint(event.pos):
             self.clicked = True
+            self.mark_dirty()
             if not self.call_on_release:
                 return self.function(
                     button=self, on_close=self.on_popup_close, **kwargs
                 )
         elif not self.real_rect and self.rect.collidepoint(event.pos):
             self.clicked = True
+            self.mark_dirty()
             if not self.call_on_release:
                 return self.function(
                     button=self, on_close=self.on_popup_close, **kwargs
@@ -125,6 +137,8 @@ class Button(object):
             )
             if saved_settings["sound_effects"] and self.click_sound:
                 self.click_sound.play()
+        if self.clicked:
+            self.mark_dirty()
         self.clicked = False
         return return_val
 
@@ -133,35 +147,51 @@ class Button(object):
         if self.real_rect and self.real_rect.collidepoint(pg.mouse.get_pos()):
             if not self.hovered:
                 self.hovered = True
+                self.mark_dirty()
                 if self.hover_sound:
                     self.hover_sound.play()
         elif not self.real_rect and self.rect.collidepoint(pg.mouse.get_pos()):
 
             if not self.hovered:
                 self.hovered = True
+                self.mark_dirty()
                 if self.hover_sound:
                     self.hover_sound.play()
-        else:
-
+        elif self.hovered:
             self.hovered = False
+            self.mark_dirty()
+
+    def mark_dirty(self):
+        """Have the part of the window under the button redrawn next frame."""
+        # real_rect is where a button on a nested surface is in the window,
+        # the others are drawn at their own rect
+        dirty_rects.mark(self.real_rect or self.rect)
 
     def disable(self):
+        if self.disabled:
+            return
+        self.mark_dirty()
         self.disabled = True
         self.render_text()
 
     def change_text(self, text):
         self.text = text
         self.render_text()
+        self.mark_dirty()
 
     def set_highlight(self, color):
         self.highlight_color = color
+        self.mark_dirty()
 
     def enable(self):
+        if not self.disabled:
+            return
+        self.mark_dirty()
         self.disabled = False
         self.render_text()
 
-    def update(self, surface):
-        """Update needs to be called every frame in the main loop."""
+    def look(self):
+        """The color, text and hover image the button is drawn with right now."""
         color = self.disabled_color if self.disabled else self.color
         render_text = None
         if self.text:
@@ -182,31 +212,80 @@ class Button(object):
 
         if self.highlight_color:
             color = self.highlight_color
-        # surface.fill(pg.Color("black"),self.rect)
-        # surface.fill(color,self.rect.inflate(-4,-4))
 
-        pg.draw.rect(surface, Colors.BLACK, self.rect, border_radius=self.border_radius)
+        hover_image = self.hover_image if self.hovered else None
+        return color, render_text, hover_image
+
+    def update(self, surface):
+        """Update needs to be called every frame in the main loop."""
+        color, render_text, hover_image = self.look()
+
+        # Everything the drawn button depends on, the same key is the same picture
+        key = (
+            self.rect.size,
+            self.border_radius,
+            tuple(color),
+            self.image,
+            hover_image,
+            render_text,
+            tuple((s, r.x - self.rect.x, r.y - self.rect.y) for s, r in self.tag_surfs),
+        )
+        drawn = button_surfaces.get(key)
+        if drawn is None:
+            drawn = self.draw_look(color, render_text, hover_image)
+            button_surfaces.put(key, drawn, surface_bytes(drawn[0]))
+
+        surf, offset = drawn
+        surface.blit(surf, self.rect.move(offset))
+
+    def draw_look(self, color, render_text, hover_image):
+        """Draw the button once on a surface of its own, returns it with
+        where it goes relative to the button's rect."""
+        # The image, the text and the tags may stick out of the rect
+        parts = [self.rect]
+        if self.image is not None:
+            parts.append(self.image.get_rect(center=self.rect.center))
+        if hover_image is not None:
+            parts.append(hover_image.get_rect(center=self.rect.center))
+        if render_text is not None:
+            parts.append(render_text.get_rect(center=self.rect.center))
+        parts.extend(r.inflate(5, 5) for _, r in self.tag_surfs)
+        bounds = self.rect.unionall(parts)
+        offset = (bounds.x - self.rect.x, bounds.y - self.rect.y)
+
+        # Drawn on a see through surface, what sticks out of the rect keeps
+        # its own alpha, so blitting it is the same as drawing it directly.
+        # A square button that covers all of it needs no alpha, and blits faster.
+        if bounds == self.rect and not self.border_radius:
+            surf = pg.Surface(bounds.size)
+        else:
+            surf = pg.Surface(bounds.size, pg.SRCALPHA)
+        rect = self.rect.move(-bounds.x, -bounds.y)
+
+        pg.draw.rect(surf, Colors.BLACK, rect, border_radius=self.border_radius)
         pg.draw.rect(
-            surface,
+            surf,
             color,
-            (self.rect.inflate(-4, -4)),
+            (rect.inflate(-4, -4)),
             border_radius=self.border_radius,
         )
 
         if self.image is not None:
-            image_rect = self.image.get_rect(center=self.rect.center)
-            surface.blit(self.image, image_rect)
+            image_rect = self.image.get_rect(center=rect.center)
+            surf.blit(self.image, image_rect)
 
-        if self.hovered and self.hover_image:
-            image_rect = self.hover_image.get_rect(center=self.rect.center)
-            surface.blit(self.hover_image, image_rect)
+        if hover_image is not None:
+            image_rect = hover_image.get_rect(center=rect.center)
+            surf.blit(hover_image, image_rect)
 
         if self.text and render_text:
-            text_rect = render_text.get_rect(center=self.rect.center)
-            surface.blit(render_text, text_rect)
+            text_rect = render_text.get_rect(center=rect.center)
+            surf.blit(render_text, text_rect)
 
         for s, r in self.tag_surfs:
+            r = r.move(-bounds.x, -bounds.y)
             pg.draw.rect(
-                surface, Colors.PURPLE, r.inflate(5, 5), border_radius=2,
+                surf, Colors.PURPLE, r.inflate(5, 5), border_radius=2,
             )
-            surface.blit(s, r)
+            surf.blit(s, r)
+        return surf, offset
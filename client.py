@@ -3,11 +3,20 @@ import json
 import time
 import pickle
 from pygame import mixer
-import numpy as np
-from network import Network
+import queue
+import threading
+import codec
+from avatars import decode_avatar, encode_avatar, pick_encoding, AvatarDecoder
+from async_network import AsyncNetwork
+from network import REQUEST_TIMEOUT
+from lobby_updates import LobbyUpdates
+from avatar_requests import AvatarRequests
+from avatar_cache import AvatarCache
 from constants import *
 from utilities import *
-from _thread import start_new_thread
+from dirty_rects import dirty_rects
+from text_cache import text_surfaces
+from button import button_surfaces
 
 # Initialize the display window
 WINDOW = pygame.display.set_mode((WIDTH, HEIGHT))
@@ -16,11 +25,30 @@ WINDOW = pygame.display.set_mode((WIDTH, HEIGHT))
 WINDOW_LEFT = pygame.Surface((LEFT_WIDTH, HEIGHT))
 # Right side for messages and errors
 WINDOW_RIGHT = pygame.Surface((RIGHT_WIDTH, HEIGHT))
+RIGHT_X = LEFT_WIDTH + GAP_BETWEEN_SECTIONS  # Where the right side starts in the window
 
 # Initialize clock and FPS
 clock = pygame.time.Clock()
 fps = 30
+idle_wait = 0.5  # Seconds to sleep at most while nothing happens, the connection readout updates this often
+frame_time = 0  # Milliseconds the last frame took, not counting the time spent waiting
+woken = threading.Event()  # Set by other threads when they have something for the main loop
 run = True  # Flag to control the main loop
+message_budget = 0.01  # Seconds per frame spent handling server messages
+sound_to_play = None  # Sound effect for the message being handled
+pending_image = None  # Details of an image whose bytes have not arrived yet
+lobby_updates = LobbyUpdates()  # Lobby changes waiting for the next layout pass
+offer = None  # Future of the server's answer to offering an image, with the image and a deadline
+upload = None  # Transfer of the profile image being uploaded, if any
+unfinished_upload = None  # Details and bytes of that image, until the server has all of it
+pending_users = {}  # Users of the lobby that don't have a button yet, in order
+lobby_fill_budget = 0.008  # Seconds per frame spent making buttons for them
+avatar_requests = AvatarRequests()  # Avatars asked for and kept, on servers that send them on demand
+avatar_cache = AvatarCache()  # Decoded avatars on disk, by the hash servers with "avatar_hashes" send
+unfetched_avatars = {}  # Users whose avatar is not cached, to ask for all at once
+avatar_decoder = AvatarDecoder(on_ready=woken.set)  # Threads that decode and scale avatars
+prepared_avatars = {}  # Avatars that were ready before their user's button
+drawn_screen = None  # The screen drawn last frame, another one is drawn in full
 
 
 # Function to render text on the screen
@@ -96,13 +124,48 @@ def connect(error=None):
         WINDOW.fill(Colors.BLACK)
         return connect(error="Port must be a valid number.")
 
-    # Initialize network and connect to server
-    n = Network(ip, int(port))
-    data = n.connect()
+    # Initialize network and connect to server in the background,
+    # keeping the window responsive while the connection is set up
+    n = AsyncNetwork(ip, int(port))
+    pending = n.start_connect()
+    started = time.time()
+
+    # Button to give up on this server and enter another one
+    cancel_button = Button(
+        (WIDTH / 2 - 100, HEIGHT / 2 + 100, 200, 100),
+        Colors.RED,
+        lambda *args, **kwargs: True,
+        text="cancel",
+        **Button_Styles.CHALLENGE_BUTTON_STYLE,
+    )
+    while not pending.done():
+        clock.tick(fps)
+        cancelled = False
+        for e in pygame.event.get():
+            if e.type == pygame.QUIT:
+                pygame.quit()
+                quit()
+            if e.type == pygame.KEYDOWN and e.key == pygame.K_ESCAPE:
+                cancelled = True
+            cancelled = cancel_button.check_event(e) or cancelled
+
+        if cancelled:
+            pending.cancel()
+            n.close()
+            return connect(error="Connecting was cancelled.")
+
+        WINDOW.fill(Colors.BLACK)
+        write(WINDOW, f"Connecting to {ip}:{port}... {time.time() - started:.1f}s",
+              WIDTH / 2, HEIGHT / 2)
+        cancel_button.update(WINDOW)
+        pygame.display.update()
+
+    data = pending.result()
     if data:
         curr_user_id = data
         return n, curr_user_id
     else:
+        n.close()
         WINDOW.fill(Colors.BLACK)
         return connect(
             error="Could not connect. Please check if the IP and Port are correct."
@@ -111,15 +174,40 @@ def connect(error=None):
 
 # Function to receive the list of active users from the server
 def recieve_active_users():
+    global curr_user_id
     WINDOW.fill(Colors.BLACK)
     write(
         WINDOW, f"Receiving other users from server. - {0}%", WIDTH / 2, HEIGHT / 2)
 
+    # Keep the window answering while waiting. If the connection drops first,
+    # the messages about getting it back come before the lobby does
+    active_users = None
+    while True:
+        for e in pygame.event.get():
+            if e.type == pygame.QUIT:
+                pygame.quit()
+                quit()
+        try:
+            active_users = n.recv(timeout=1 / fps)
+        except queue.Empty:
+            continue
+
+        if isinstance(active_users, dict) and "reconnecting" in active_users:
+            print(f"CONNECTION LOST. RECONNECTING (attempt {active_users['reconnecting']})")
+            continue
+        if isinstance(active_users, dict) and "reconnected" in active_users:
+            details = active_users["reconnected"]
+            if details["resumed"]:
+                continue  # The lobby is replayed next
+            # A new session comes with its own id and lobby
+            curr_user_id = details["id"]
+            active_users = details["users"]
+        break
+
     try:
-        active_users = n.recv()
         if not active_users:
             raise Exception("SERVER CRASHED UNEXPECTEDLY")
-        return active_users
+        return first_lobby_page(active_users)
 
     except Exception as e:
         global run
@@ -128,6 +216,16 @@ def recieve_active_users():
         run = False
 
 
+# Function to get the users out of the first lobby message. Servers with
+# lobby pages send the lobby in several messages, starting with the current
+# user and one screen of buttons, and the rest follows as "lobby_page" messages.
+def first_lobby_page(data):
+    pending_users.clear()
+    if "lobby_page" in data:
+        return dict(data["lobby_page"]["users"])
+    return data
+
+
 # Function to navigate to the previous page
 def prev_page(*args, **kwargs):
     global current_display, displays
@@ -164,7 +262,8 @@ def go_to_settings(*args, **kwargs):
 
 # Function to send data to the server
 def send(data, pickle_data=True):
-    sent = n.send(data, pickle_data)
+    # Messages are written together once per frame, see main()
+    sent = n.send_later(data, pickle_data)
     return sent
 
 
@@ -213,7 +312,7 @@ def on_profile_close(**kwargs):
 def on_user_button_click(user_button, **kwargs):
     global active_profile
     # Get the profile for the clicked user
-    active_profile = user_profiles[user_button.id]
+    active_profile = get_profile(user_button.id)
     add_page("user_profile")
 
 
@@ -244,38 +343,85 @@ def send_update_details_request(changed, *args, **kwargs):
     send(req)
 
 
-# Function to display the upload progress of an image
-def upload_screen(batch_number, n_batches):
-    check_quit()
-    WINDOW.fill(Colors.BLACK)
-    write(
-        WINDOW,
-        f"Uploading Image - {round((batch_number) / n_batches * 100)}%",
-        WIDTH / 2,
-        HEIGHT / 2,
-    )
-
-
-# Function to send an image to the server in batches
+# Function to send an image to the server, the upload itself runs in the background
 def send_image(img):
-    WINDOW.fill(Colors.BLACK)
-    write(WINDOW, f"Uploading Image - {0}%", WIDTH / 2, HEIGHT / 2)
-
-    image_bytes = img.tobytes()
-    size = len(image_bytes)
-
-    # Send the size and metadata of the image to the server
-    send({"image": {"size": size, "shape": img.shape, "dtype": img.dtype}})
+    # Compress the image if the server agreed to an encoding for avatars
+    encoding = pick_encoding(n.features)
+    image_bytes = encode_avatar(img, encoding)
+
+    details = {"shape": img.shape, "dtype": img.dtype}
+    if encoding != "raw":
+        details["encoding"] = encoding
+    upload_image(details, image_bytes)
+
+
+# Function to offer an image to the server and send the part it doesn't have.
+# Servers with "uploads" skip images they already have, and go on with one
+# that was cut off from where it stopped.
+def upload_image(details, image_bytes):
+    global offer
+
+    # Send the size and metadata of the image to the server, check_offer()
+    # goes on once it answers, other messages keep going to the handlers
+    future = n.start_offer("image", details, image_bytes, ("image_allowed", "error"))
+    future.add_done_callback(lambda future: woken.set())
+    offer = (future, details, image_bytes, time.monotonic() + REQUEST_TIMEOUT)
+
+
+# Function to start the upload once the server answered the offer of an image
+def check_offer():
+    global offer, upload, unfinished_upload
+    if offer is None:
+        return
+    future, details, image_bytes, deadline = offer
+    if not future.done() and time.monotonic() < deadline:
+        return
+
+    offer = None
+    # Past the deadline, or the connection dropped before the answer came
+    if not future.done() or future.exception() is not None:
+        n.forget_request(future)
+        popups["error"].add_popup(
+            "Error", "The server did not answer.", text_color=Colors.RED)
+        return
+    allowed = n.upload_offset(future.result(), image_bytes)
 
-    allowed = n.recv()
     # Check if the image was accepted by the server
     if not allowed.get("image_allowed"):
         popups["error"].add_popup(
             "Error", allowed.get("error"), text_color=Colors.RED)
-    else:
-        print("Started sending image")
-        n.send(image_bytes, pickle_data=False, fn=upload_screen)
+        return
+
+    offset = allowed["offset"]
+    if offset >= len(image_bytes):
+        print("The server already has this image")
+        unfinished_upload = None
+        return
+
+    print("Started sending image" if offset == 0 else f"Resuming image upload at byte {offset}")
+    unfinished_upload = (details, image_bytes)
+    upload = n.send_upload(image_bytes, offset)
+
+
+# Function to report the end of the background upload, once it is over
+def check_upload():
+    global upload, unfinished_upload
+    if upload is None or not upload.done:
+        return
+
+    if upload.result():
         print("Done sending image")
+        unfinished_upload = None
+    elif "uploads" in n.features:
+        # Kept for when the connection is back, the server knows how far it got
+        popups["error"].add_popup(
+            "Error", "The upload was cut off, it will go on after reconnecting.", text_color=Colors.RED)
+    else:
+        unfinished_upload = None
+        popups["error"].add_popup(
+            "Error", "Could not upload the image.", text_color=Colors.RED)
+    upload = None
+    dirty_rects.mark(upload_bar.rect.move(RIGHT_X, 0))  # Take the bar away
 
 
 # Function to handle changes to the profile picture
@@ -293,43 +439,246 @@ def on_image_change(path, *args, **kwargs):
 
 
 # Function to add a new user to the active users list
-def add_user(user_data):
+def add_user(user_data, refresh=True):
     user_id = user_data["id"]
     active_users[user_id] = user_data
 
-    user_buttons.add_user_button(
-        user_data, user_id == curr_user_id, on_user_button_click
-    )
-
-    user_profiles[user_id] = Profile(
-        user_data,
-        user_id == curr_user_id,
-        on_profile_close,
-        on_challenge_button_click,
-        on_user_name_change=send_update_details_request,
-        on_image_change=on_image_change,
-    )
+    # Images that came with the lobby are made into surfaces on the worker threads
+    image = user_data.get("image")
+    if image is not None and not isinstance(image, pygame.Surface):
+        user_data["image"] = None
+        prepare_avatar_later(user_id, lambda: pygame.surfarray.make_surface(image))
 
+    # Unless avatars wait to be shown, one that is only hashed is needed now
+    elif user_data.get("image_hash") and image is None and "avatar_requests" not in n.features:
+        if not load_cached_avatar(user_id):
+            unfetched_avatars[user_id] = True
 
-# Function to generate user buttons and profiles for the home page
+    user_buttons.add_user_button(
+        user_data, user_id == curr_user_id, on_user_button_click, refresh=refresh
+    )
+    if user_id in prepared_avatars:
+        user_buttons.set_avatar(user_id, prepared_avatars.pop(user_id))
+
+
+# Function to get the profile of a user, it is only made when first opened
+def get_profile(user_id):
+    if user_id not in user_profiles:
+        user_data = active_users[user_id]
+        profile = Profile(
+            user_data,
+            user_id == curr_user_id,
+            on_profile_close,
+            on_challenge_button_click,
+            on_user_name_change=send_update_details_request,
+            on_image_change=on_image_change,
+        )
+        user_profiles[user_id] = profile
+        # Its background is scaled on the worker threads, unless an avatar on
+        # its way there already gets one
+        image = user_data.get("image")
+        if isinstance(image, pygame.Surface) and not avatar_decoder.preparing(user_id):
+            prepare_avatar_later(user_id, lambda: image)
+    return user_profiles[user_id]
+
+
+# Handle the next part of the lobby, its buttons are made a few per frame
+def on_lobby_page(page):
+    for user_id, user_data in page["users"].items():
+        active_users[user_id] = user_data
+        pending_users[user_id] = user_data
+
+
+# Function to make buttons for the waiting users, for at most lobby_fill_budget seconds
+def fill_lobby():
+    if not pending_users:
+        return
+    deadline = time.perf_counter() + lobby_fill_budget
+    while pending_users and time.perf_counter() < deadline:
+        user_id = next(iter(pending_users))
+        add_user(pending_users.pop(user_id), refresh=False)
+    user_buttons.refresh()
+
+
+# Function to have an avatar loaded and scaled on the worker threads,
+# apply_avatars() puts it in once it is ready
+def prepare_avatar_later(user_id, load):
+    user_data = active_users[user_id]
+    sizes = {
+        "button_size": (user_buttons.user_button_w, user_buttons.user_button_h),
+        "text_size": Button_Styles.USER_BUTTON_STYLE["font"].size(str(user_data["username"])),
+    }
+    # An open profile gets its background made as well
+    if user_id in user_profiles:
+        sizes["profile_size"] = (LEFT_WIDTH, HEIGHT)
+    avatar_decoder.submit(user_id, load, **sizes)
+
+
+# Function to load a user's avatar from the disk cache, False if it isn't there.
+# Servers with "avatar_hashes" send the hash of an avatar and only send the image when asked.
+def load_cached_avatar(user_id):
+    image_hash = active_users[user_id].get("image_hash")
+    if not image_hash or image_hash not in avatar_cache:
+        return False
+
+    def load():
+        image = avatar_cache.get(image_hash)
+        return None if image is None else pygame.surfarray.make_surface(image)
+
+    prepare_avatar_later(user_id, load)
+    return True
+
+
+# Function to put in the avatars that the worker threads have made ready
+def apply_avatars():
+    for user_id, avatar in avatar_decoder.finished():
+        if user_id not in active_users:
+            continue
+        # It left the disk cache in the meantime, so the server has to send it
+        if avatar is None:
+            if "avatar_requests" in n.features:
+                avatar_requests.forget(user_id)
+            else:
+                unfetched_avatars[user_id] = True
+            continue
+        set_avatar(user_id, avatar)
+
+
+# Function to ask for the avatars of the visible page, the open profile and
+# the next page. Servers with "avatar_requests" leave images out of the lobby.
+def fetch_avatars():
+    global unfetched_avatars
+    if "avatar_requests" not in n.features:
+        missing = [id for id in unfetched_avatars if id in active_users]
+        unfetched_avatars = {}
+        if missing:
+            n.send_later({"get_avatars": missing})
+        return
+
+    page = user_buttons.current_page
+    ids = user_buttons.page_ids(page)
+    if active_profile:
+        ids.append(active_profile.user["id"])
+    ids.extend(user_buttons.page_ids(page + 1))
+
+    ids = [
+        id for id in ids
+        if active_users.get(id, {}).get("has_image") or active_users.get(id, {}).get("image_hash")
+    ]
+    missing = [id for id in avatar_requests.want(ids) if not load_cached_avatar(id)]
+    if missing:
+        n.send_later({"get_avatars": missing})
+
+
+# Function to show a prepared avatar, and on servers that send them on demand forget the oldest
+def set_avatar(id, avatar):
+    active_users[id]["image"] = avatar.surface
+    if id in pending_users:
+        prepared_avatars[id] = avatar
+    elif id in user_buttons.user_buttons:
+        user_buttons.set_avatar(id, avatar)
+
+    if id in user_profiles:
+        if avatar.profile_image is not None:
+            user_profiles[id].set_background(avatar.profile_image)
+        else:
+            # The profile was opened after this one was sent off, make its background too
+            prepare_avatar_later(id, lambda: avatar.surface)
+
+    if "avatar_requests" in n.features:
+        for old in avatar_requests.recieved(id):
+            drop_avatar(old)
+
+
+# Function to forget the avatar of a user that is far off screen, it is asked for again when needed
+def drop_avatar(id):
+    if id not in active_users:
+        return
+    active_users[id]["image"] = None
+    prepared_avatars.pop(id, None)
+    if id in user_buttons.user_buttons:
+        user_buttons.update_button(id, {"image": None})
+    if not active_profile or active_profile.user["id"] != id:
+        user_profiles.pop(id, None)
+
+
+# Function to generate user buttons for the home page
 def generate_users():
     # Add the current user first to pin them to the top
-    add_user(curr_user)
+    add_user(curr_user, refresh=False)
 
     # Add buttons for all other active users
     for key in active_users.keys():
         if key != curr_user_id:
-            add_user(active_users[key])
+            add_user(active_users[key], refresh=False)
+
+    user_buttons.refresh()
+
+
+# Function to start over with the lobby of a new session, after a reconnect
+def reload_lobby(new_id, users):
+    global curr_user_id, active_users, curr_user, user_buttons, user_profiles, displays, current_display, active_profile, game_board, active_game, game_details, avatar_requests
+
+    # A game of the old session is over
+    if active_game and not active_game.game_over:
+        popups["error"].add_popup(
+            "Error", "The connection was lost, the game has ended.", text_color=Colors.RED)
+
+    curr_user_id = new_id
+    active_users = first_lobby_page(users)
+    curr_user = active_users[curr_user_id]
+
+    user_buttons = UserButton_Container()
+    user_profiles = {}
+    displays = ["home"]
+    current_display = 0
+    active_profile = None
+    game_board = None
+    active_game = None
+    game_details = None
+    lobby_updates.clear()
+    avatar_requests = AvatarRequests()
+    unfetched_avatars.clear()
+    avatar_decoder.clear()
+    prepared_avatars.clear()
+
+    generate_users()
 
 
 # Function to remove a user from the active users list
 def del_user(id):
-    active_users.pop(id)
-    user_buttons.remove_user_button(id)
-    user_profiles.pop(id)
+    del_users([id])
+
+
+# Function to remove several users with a single layout pass
+def del_users(ids):
+    for id in ids:
+        active_users.pop(id)
+        user_profiles.pop(id, None)
+        pending_users.pop(id, None)
+        avatar_requests.forget(id)
+        avatar_decoder.forget(id)
+        prepared_avatars.pop(id, None)
+
+        if active_profile and active_profile.user["id"] == id:
+            active_profile.on_disconnect()
+
+    user_buttons.remove_user_buttons(ids)
+
+
+# Function to apply the lobby changes collected since the last layout pass
+def apply_lobby_updates():
+    removed, added, changed = lobby_updates.flush()
+    if removed:
+        del_users(removed)
+
+    for user_data in added:
+        add_user(user_data, refresh=False)
+    if added:
+        user_buttons.refresh()
 
-    if active_profile and active_profile.user["id"] == id:
-        active_profile.on_disconnect()
+    for id, user_changes in changed.items():
+        update_user(id, user_changes)
 
 
 # Function to update user statistics
@@ -339,9 +688,22 @@ def update_user(id, changed):
             curr_user[key] = changed[key]
         active_users[id][key] = changed[key]
 
+    # A new avatar is only announced, it is asked for once the user is on screen
+    if changed.get("has_image") or changed.get("image_hash"):
+        avatar_requests.forget(id)
+
+        # or right away, from the disk cache if it is there, if avatars don't wait
+        if changed.get("image_hash") and "avatar_requests" not in n.features:
+            if not load_cached_avatar(id):
+                unfetched_avatars[id] = True
+
+    # Users without a button yet get it made from the changed details
+    if id in pending_users:
+        return
+
     user_buttons.update_button(id, changed)
-    user_profile = user_profiles[id]
-    user_profile.update(changed=changed)
+    if id in user_profiles:
+        user_profiles[id].update(changed=changed)
 
 
 # Function to handle pygame quit event and exit the application cleanly
@@ -361,204 +723,349 @@ def check_quit():
                 quit()
 
 
-# Function to process received data from the server
-def on_recieve(data):
-    global displays, current_display, game_details, active_game, game_board, run, ind, active_profile, challenge_form, popup
+# Function to pick the sound effect for the message being handled
+def set_sound(sound):
+    global sound_to_play
+    sound_to_play = sound
 
-    sound_to_play = None
 
-    # Check if no data is received, indicating server might be down or connection is lost
-    if not data:
-        print("SERVER DOWN. OR CONNECTION LOST.")
-        run = False
-        return True
+# Handle a new user connection
+def on_connected(user_data):
+    # user_data contains the details of the newly connected user
+    add_user(user_data)
 
-    # Handle a new user connection
-    if data.get("connected"):
-        # data["connected"] contains the details of the newly connected user
-        add_user(data["connected"])
-
-    # Handle a user disconnection
-    if data.get("disconnected"):
-        # data["disconnected"] contains the id of the disconnected user
-        del_user(data["disconnected"])
-
-    # Handle received message
-    if data.get("message"):
-        # Default properties for the message popup
-        popup_props = {
-            "title": data["message"]["title"],
-            "button_props": [],
-        }
 
-        # Add properties for buttons in the message popup (if any)
-        if data["message"].get("buttons"):
-            for b in data["message"]["buttons"]:
-                popup_props["button_props"].append(default_buttons[b])
+# Handle a user disconnection
+def on_disconnected(user_id):
+    del_user(user_id)
 
-        # Add additional properties for the message popup
-        if data["message"].get("text"):
-            popup_props["text"] = data["message"]["text"]
-        if data["message"].get("context"):
-            popup_props["context"] = data["message"]["context"]
-        if data["message"].get("closeable") is not None:
-            popup_props["closeable"] = data["message"].get("closeable")
-        if data["message"].get("id") is not None:
-            popup_props["id"] = data["message"].get("id")
 
-        # Add the message to the messages section
-        popups["message"].add_popup(**popup_props)
+# Handle received message
+def on_message(message):
+    # Default properties for the message popup
+    popup_props = {
+        "title": message["title"],
+        "button_props": [],
+    }
 
-        sound_to_play = Sound_Effects.message
+    # Add properties for buttons in the message popup (if any)
+    if message.get("buttons"):
+        for b in message["buttons"]:
+            popup_props["button_props"].append(default_buttons[b])
 
-    # Handle received error message
-    if data.get("error"):
-        popups["error"].add_popup(
-            "Error", data["error"], text_color=Colors.RED,
-        )
-        sound_to_play = Sound_Effects.error
+    # Add additional properties for the message popup
+    if message.get("text"):
+        popup_props["text"] = message["text"]
+    if message.get("context"):
+        popup_props["context"] = message["context"]
+    if message.get("closeable") is not None:
+        popup_props["closeable"] = message.get("closeable")
+    if message.get("id") is not None:
+        popup_props["id"] = message.get("id")
 
-    # Handle the start of a new game
-    if data.get("new_game"):
-        # Game details {game_id, board}
-        game_details = data["new_game"]["details"]
-        game_name = data["new_game"]["game"]  # Game name
+    # Add the message to the messages section
+    popups["message"].add_popup(**popup_props)
 
-        # Initialize the game board based on the game type
-        if game_name == "tic_tac_toe":
-            game_board = TTT_Board(
-                X_id=game_details["board"].X_id,
-                O_id=game_details["board"].O_id,
-                on_button_click=move,
-                rows=game_details["board"].rows,
-                cols=game_details["board"].cols,
-            )
-        elif game_name == "connect4":
-            game_board = Connect4_Board(
-                curr_user_id,
-                game_details["board"].red_id,
-                game_details["board"].blue_id,
-                on_button_click=move,
-                rows=game_details["board"].rows,
-                cols=game_details["board"].cols,
-            )
-
-        # Create a wrapper for the game board
-        active_game = Game_Template(
+    set_sound(Sound_Effects.message)
+
+
+# Handle received error message
+def on_error(error):
+    popups["error"].add_popup(
+        "Error", error, text_color=Colors.RED,
+    )
+    set_sound(Sound_Effects.error)
+
+
+# Handle the start of a new game
+def on_new_game(new_game):
+    global game_details, active_game, game_board
+
+    # Game details {game_id, board}
+    game_details = new_game["details"]
+    game_name = new_game["game"]  # Game name
+
+    # Servers that support it send a compact snapshot instead of the game object
+    board = game_details["board"]
+    if isinstance(board, (bytes, bytearray)):
+        board = codec.unpack_board(board)
+
+    # Initialize the game board based on the game type
+    if game_name == "tic_tac_toe":
+        game_board = TTT_Board(
+            X_id=board.X_id,
+            O_id=board.O_id,
+            on_button_click=move,
+            rows=board.rows,
+            cols=board.cols,
+        )
+    elif game_name == "connect4":
+        game_board = Connect4_Board(
             curr_user_id,
-            data["new_game"]["players"],
-            data["new_game"]["identification_dict"],
-            game_details["board"].turn_id,
-            game_name,
-            game_board,
-            on_quit=quit_game,
+            board.red_id,
+            board.blue_id,
+            on_button_click=move,
+            rows=board.rows,
+            cols=board.cols,
         )
 
-        add_page("game")
-        sound_to_play = Sound_Effects.game_start
-
-    # Handle a move made by a player
-    if data.get("moved"):
-        game_board.place(data["moved"]["to"], data["moved"]["turn_string"])
-        active_game.set_turn(data["moved"]["turn_id"])
-        sound_to_play = Sound_Effects.select
-
-    # Handle game over scenario
-    if data.get("game_over"):
-        sound_to_play = None
-        active_game.game_over_protocol(data["game_over"])
-
-    # Handle profile image update
-    if data.get("image"):
-        size, shape, dtype, id = (
-            data["image"]["size"],
-            data["image"]["shape"],
-            data["image"]["dtype"],
-            data["image"]["user_id"],
-        )
+    # A snapshot of a game in progress (after a reconnect) already has moves on it
+    for ind, mark in enumerate(getattr(board, "cells", None) or []):
+        if mark is None:
+            continue
+        if game_name == "tic_tac_toe":
+            game_board.place(ind, mark)
+        else:
+            game_board.place(divmod(ind, board.cols), mark)
+
+    # Create a wrapper for the game board
+    active_game = Game_Template(
+        curr_user_id,
+        new_game["players"],
+        new_game["identification_dict"],
+        board.turn_id,
+        game_name,
+        game_board,
+        on_quit=quit_game,
+    )
+
+    add_page("game")
+    set_sound(Sound_Effects.game_start)
+
+
+# Handle the connection dropping, the network thread is trying to get it back
+def on_reconnecting(attempt):
+    print(f"CONNECTION LOST. RECONNECTING (attempt {attempt})")
+    connection_indicator.set_status(f"reconnecting ({attempt})")
+
+
+# Handle getting the connection back
+def on_reconnected(details):
+    global upload
+    connection_indicator.set_status(None)
+
+    # Go on with an upload that the connection dropping cut off
+    if unfinished_upload and offer is None and (upload is None or upload.done):
+        upload = None
+        upload_image(*unfinished_upload)
+
+    # The server kept the session, the missed messages are replayed after this
+    if details["resumed"]:
+        return
+
+    # A new session: nothing of the old one is left on the server
+    reload_lobby(details["id"], details["users"])
 
-        # Receive the full image data
-        full_image = n.recv(load=False)
 
-        if full_image == "":  # Server might be down
-            run = False
-            return True
+# Handle a move made by a player
+def on_moved(moved):
+    game_board.place(moved["to"], moved["turn_string"])
+    active_game.set_turn(moved["turn_id"])
+    set_sound(Sound_Effects.select)
 
-        # Convert the received bytes into an image
-        image = np.frombuffer(full_image, dtype=dtype).reshape(*shape)
-        surf = pygame.surfarray.make_surface(image)
-        changed = {"image": surf}
-        update_user(id, changed)
 
-    # Handle user profile updates
-    if data.get("updated"):
-        update_user(data["updated"]["user_id"], data["updated"]["changed"])
+# Handle game over scenario
+def on_game_over(game_over):
+    set_sound(None)
+    active_game.game_over_protocol(game_over)
+
+
+# Handle profile image update, the image itself follows as the next payload
+def on_image(image):
+    global pending_image
+    pending_image = image
+
+
+# Have the received bytes of the announced image made into a surface
+def on_image_data(full_image):
+    global pending_image
+    image_details, pending_image = pending_image, None
+    if image_details is None or image_details["user_id"] not in active_users:
+        return
+
+    # Decompressing, caching and scaling it happens on the worker threads
+    def load():
+        surf = decode_avatar(full_image, image_details)
+        if image_details.get("hash"):
+            avatar_cache.put(image_details["hash"], pygame.surfarray.array3d(surf))
+        return surf
+
+    prepare_avatar_later(image_details["user_id"], load)
+
+
+# Handle user profile updates
+def on_updated(updated):
+    update_user(updated["user_id"], updated["changed"])
+
+
+# Handlers for every type of message, in the order they run when a
+# message carries more than one of them
+message_handlers = {
+    "connected": on_connected,
+    "disconnected": on_disconnected,
+    "message": on_message,
+    "error": on_error,
+    "new_game": on_new_game,
+    "moved": on_moved,
+    "game_over": on_game_over,
+    "image": on_image,
+    "updated": on_updated,
+    "lobby_page": on_lobby_page,
+    "reconnecting": on_reconnecting,
+    "reconnected": on_reconnected,
+}
+
+
+# Function to process received data from the server
+def on_recieve(data):
+    global run
+
+    # Check if no data is received, indicating server might be down or connection is lost
+    if not data:
+        print("SERVER DOWN. OR CONNECTION LOST.")
+        run = False
+        return True
+
+    # Raw bytes are the payload of the image announced by the previous message
+    if isinstance(data, (bytes, bytearray)):
+        on_image_data(data)
+        return
+
+    set_sound(None)
+    for message_type, handler in message_handlers.items():
+        if data.get(message_type):
+            handler(data[message_type])
 
     # Play the corresponding sound effect if sound effects are enabled
     if saved_settings["sound_effects"] and sound_to_play:
         sound_to_play.play()
 
-    sound_to_play = None
 
-
-# Function to receive data from the server in a loop
+# Function to process the data the network thread has queued up, for at most
+# message_budget seconds so a burst of messages can't stall a frame
 def recieve():
-    global displays, current_display, game_details, active_game, game_board, run, ind, active_profile, challenge_form, popup
+    deadline = time.perf_counter() + message_budget
     while run:
-        # Receive data from the server
-        data = n.recv()
-        # Process the received data
-        done = on_recieve(data)
+        try:
+            data = n.messages.get_nowait()
+        except queue.Empty:
+            break
+
+        # Lobby changes are merged and laid out together at the end of the frame
+        if LobbyUpdates.accepts(data):
+            lobby_updates.add(data)
+            done = False
+        else:
+            # Anything else may depend on them, so they are applied first
+            apply_lobby_updates()
+            # Process the received data
+            done = on_recieve(data)
 
         # Exit the loop if there was an issue processing the data
-        if done:
+        if done or time.perf_counter() >= deadline:
             break
 
+    apply_lobby_updates()
+
 
 # Function to draw all visual elements on the screen
 def draw(left_win, right_win, user_buttons):
-    # Fill the left and right surfaces with their respective background colors
-    left_win.fill(Colors.BG_COLOR)
-    right_win.fill(Colors.LIGHT_BROWN)
+    global drawn_screen
 
-    # Draw the content based on the current display
-    if displays[current_display] == "home":
-        # Draw user buttons on the left side for the home display
-        user_buttons.draw(left_win)
+    # Another screen than last frame is drawn in full
+    screen = (displays[current_display], active_profile, active_game)
+    if screen != drawn_screen:
+        dirty_rects.mark_all()
+        drawn_screen = screen
 
-    elif displays[current_display] == "user_profile":
-        # Draw the active user profile on the left side
-        active_profile.draw(left_win)
+    # Parts that change without any event: animations, the upload and the connection readout
+    if displays[current_display] == "game" and active_game.animating():
+        dirty_rects.mark(left_win.get_rect())
+    if upload is not None:
+        dirty_rects.mark(upload_bar.rect.move(RIGHT_X, 0))
+    changed = connection_indicator.refresh(n.connection_stats, frame_time)
+    if changed:
+        dirty_rects.mark(changed.move(RIGHT_X, 0))
 
-    elif displays[current_display] == "game":
-        # Draw the active game board on the left side
-        active_game.draw(left_win)
+    # Nothing changed, nothing to draw
+    rects = dirty_rects.take()
+    if not rects:
+        return
 
-    elif displays[current_display] == "settings":
-        # Draw the settings page on the left side
-        settings_page.draw(left_win)
+    # The part of each side to redraw, everything outside it stays as it is
+    left_area = dirty_area(rects, left_win, 0)
+    right_area = dirty_area(rects, right_win, RIGHT_X)
 
-    # Draw all popups on the right side
-    for p_container in popups.values():
-        p_container.draw(right_win)
+    if left_area:
+        left_win.set_clip(left_area)
+        # Fill the left surface with its background color
+        left_win.fill(Colors.BG_COLOR)
 
-    # Draw navigation buttons on the right side
-    navigation_buttons.draw(right_win)
+        # Draw the content based on the current display
+        if displays[current_display] == "home":
+            # Draw user buttons on the left side for the home display
+            user_buttons.draw(left_win)
 
-    # Update the main window with the left and right surfaces
-    WINDOW.blit(left_win, (0, 0))
-    WINDOW.blit(right_win, (LEFT_WIDTH + GAP_BETWEEN_SECTIONS, 0))
-    pygame.display.update()
+        elif displays[current_display] == "user_profile":
+            # Draw the active user profile on the left side
+            active_profile.draw(left_win)
+
+        elif displays[current_display] == "game":
+            # Draw the active game board on the left side
+            active_game.draw(left_win)
+
+        elif displays[current_display] == "settings":
+            # Draw the settings page on the left side
+            settings_page.draw(left_win)
+
+        left_win.set_clip(None)
+        WINDOW.blit(left_win, left_area.topleft, left_area)
+
+    if right_area:
+        right_win.set_clip(right_area)
+        # Fill the right surface with its background color
+        right_win.fill(Colors.LIGHT_BROWN)
+
+        # Draw all popups on the right side
+        for p_container in popups.values():
+            p_container.draw(right_win)
+
+        # Draw navigation buttons on the right side
+        navigation_buttons.draw(right_win)
+
+        # Show how far along the upload of a profile image is
+        if upload is not None:
+            upload_bar.draw(right_win, upload.fraction())
+
+        # Show the round trip to the server and the time the last frame took
+        connection_indicator.draw(right_win)
+
+        right_win.set_clip(None)
+        WINDOW.blit(right_win, (RIGHT_X + right_area.x, right_area.y), right_area)
+
+    # Only the changed parts of the window go to the screen
+    pygame.display.update(rects)
+
+
+# Function to get the part of a side of the window, at x, covered by the dirty rects
+def dirty_area(rects, win, x):
+    bounds = win.get_rect()
+    parts = [r.move(-x, 0).clip(bounds) for r in rects]
+    parts = [r for r in parts if r.width and r.height]
+    if not parts:
+        return None
+    return parts[0].unionall(parts[1:])
 
 
 # Function to initialize all variables and connect to the server
 def setup(error=None):
-    global n, curr_user_id, active_users, curr_user, user_buttons, user_profiles, displays, current_display, active_profile, settings_page, popups, game_board, active_game, game_details, default_buttons, navigation_buttons
+    global n, curr_user_id, active_users, curr_user, user_buttons, user_profiles, displays, current_display, active_profile, settings_page, popups, game_board, active_game, game_details, default_buttons, navigation_buttons, upload_bar, connection_indicator
 
     # Connect to the server and initialize network
     init_data = connect(error)
     if init_data:
         n, curr_user_id = init_data
+        n.on_message = woken.set  # Messages end the main loop's wait
     else:
         raise Exception(
             "COULD NOT CONNECT TO SERVER. PLEASE MAKE SURE YOU ARE CONNECTING TO THE RIGHT IP ADDRESS AND PORT, AND THAT YOUR INTERNET IS WORKING."
@@ -619,16 +1126,52 @@ def setup(error=None):
     navigation_buttons = Navigators(
         prev_page, next_page, go_to_home, go_to_settings)
 
-    # Generate user buttons and profiles for the home page
+    # Thin bar above the navigation buttons for background uploads
+    upload_bar = Progress_Bar(0, 0, RIGHT_WIDTH, 8)
+
+    # Connection quality, just under the navigation buttons
+    connection_indicator = Connection_Indicator(RIGHT_WIDTH - 5, navigation_buttons.h)
+
+    # Generate user buttons for the home page
     generate_users()
 
 
+# Function to check if the next frame has to come right away: something is
+# moving, or there is work left that doesn't come with an event
+def needs_frames():
+    return bool(
+        dirty_rects
+        or not n.messages.empty()  # More than message_budget allowed last frame
+        or pending_users
+        or upload is not None
+        or (displays[current_display] == "game" and active_game.animating())
+        # Held keys keep deleting text, without new events
+        or (displays[current_display] == "user_profile" and any(pygame.key.get_pressed()))
+    )
+
+
+# Function to sleep until there is input, a message or an avatar, or for
+# idle_wait at most so the connection readout stays up to date. Input is
+# looked at fps times a second like before, while the network and avatar
+# threads end the sleep straight away through woken. (pygame.event.wait()
+# checks for events every millisecond while it waits, which costs more.)
+# Returns the events that came in while waiting.
+def wait_for_events():
+    deadline = time.perf_counter() + idle_wait
+    while time.perf_counter() < deadline:
+        if woken.wait(1 / fps):
+            return []
+        # Taken off the queue rather than peeked at, pygame.event.peek() can
+        # free events that were posted with attributes before they are read
+        events = pygame.event.get()
+        if events:
+            return events
+    return []
+
+
 # Main function to control the flow of the application
 def main():
-    global run
-
-    # Start a separate thread to receive data from the server
-    start_new_thread(recieve, ())
+    global run, frame_time
 
     # Fill the main window with a black color and update the display
     WINDOW.fill(Colors.BLACK)
@@ -639,15 +1182,27 @@ def main():
         mixer.music.play(-1)
 
     while run:
+        # Draw at up to fps frames a second while something moves or is being
+        # handled, otherwise wait for input, the server or the avatar threads
+        events = [] if needs_frames() else wait_for_events()
+        woken.clear()  # Whatever it was set for is handled below
+
         # Control the frame rate of the game
         clock.tick(fps)
-        for e in pygame.event.get():
+        frame_start = time.perf_counter()
+        for e in events + pygame.event.get():
             if e.type == pygame.QUIT:
                 # Exit the application if the quit event is detected
                 run = False
                 mixer.music.stop()
                 break
 
+            # Clicks and keys can change anything on the screen, moving the
+            # mouse only changes the buttons it goes over, and they mark themselves
+            if e.type in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP, pygame.KEYDOWN,
+                          pygame.WINDOWEXPOSED):
+                dirty_rects.mark_all()
+
             # Check for events based on the current display state
             if displays[current_display] == "home":
                 user_buttons.check_event(e)
@@ -668,16 +1223,50 @@ def main():
             # Check events for navigation buttons
             navigation_buttons.check_event(e, current_display, displays)
 
+        # Handle everything the server sent since the last frame
+        recieve()
+        if not run:
+            break
+        check_offer()
+        check_upload()
+
+        # Make buttons for the rest of the lobby while it streams in
+        fill_lobby()
+
+        # Put in the avatars that were decoded since the last frame
+        apply_avatars()
+
+        # Ask for the avatars that are about to be shown
+        fetch_avatars()
+
+        # Write everything that was sent during this frame in one go
+        n.flush()
+
         # Check for key events if the current display is the user profile
         if displays[current_display] == "user_profile":
             active_profile.check_keys(pygame.key.get_pressed())
 
         # Draw all elements on the screen
         draw(WINDOW_LEFT, WINDOW_RIGHT, user_buttons)
+        frame_time = round((time.perf_counter() - frame_start) * 1000)
+
+
+# Function to print how much rendering the surface caches saved this session
+def print_cache_stats():
+    for name, cache in (("text", text_surfaces), ("button", button_surfaces)):
+        stats = cache.stats()
+        if stats["hit_rate"] is None:
+            continue
+        print(
+            f"{name} cache: {stats['hit_rate']:.0%} of {stats['hits'] + stats['misses']} renders were hits, "
+            f"{stats['entries']} surfaces in {stats['bytes'] // 1024} KiB"
+        )
 
 
 # Run the setup and main functions if this script is executed directly
 if __name__ == "__main__":
     setup()
     main()
+    avatar_decoder.close()
     print("DISCONNECTED")
+    print_cache_stats()
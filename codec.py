@@ -0,0 +1,160 @@
+import struct
+
+# Tagged values, and the board snapshots that are made of them.
+#
+# Messages themselves stay pickles. A schema codec for the hot message
+# types was tried: it made them 2-3x smaller, but encoding and decoding in
+# Python took 2-4x the CPU time of the C pickle, which costs more than the
+# bytes save.
+
+U16 = struct.Struct("!H")
+I64 = struct.Struct("!q")
+F64 = struct.Struct("!d")
+PAIR = struct.Struct("!qq")
+
+# tags for the small tagged values used where the type of a field isn't fixed
+NONE, TRUE, FALSE, INT, STR, FLOAT, INT_PAIR = b"NTFisfp"
+
+
+class DoesNotFit(Exception):
+    """The value has no tagged encoding."""
+
+
+def pack_str(out, s):
+    if type(s) is not str:
+        raise DoesNotFit
+    try:
+        b = s.encode()  # lone surrogates can't be utf-8
+        out += U16.pack(len(b))  # nor can strings over 64 KiB be packed
+    except (UnicodeEncodeError, struct.error):
+        raise DoesNotFit
+    out += b
+
+
+def unpack_str(data, i):
+    (n,) = U16.unpack_from(data, i)
+    i += U16.size
+    return str(data[i : i + n], "utf-8"), i + n
+
+
+# a None, bool, int, float, str or pair of ints, with a tag in front
+def pack_value(out, v):
+    t = type(v)
+    if t is int:
+        out.append(INT)
+        try:
+            out += I64.pack(v)
+        except struct.error:
+            raise DoesNotFit
+    elif t is str:
+        out.append(STR)
+        pack_str(out, v)
+    elif v is None:
+        out.append(NONE)
+    elif v is True:
+        out.append(TRUE)
+    elif v is False:
+        out.append(FALSE)
+    elif t is float:
+        out.append(FLOAT)
+        out += F64.pack(v)
+    elif t is tuple and len(v) == 2 and type(v[0]) is int and type(v[1]) is int:
+        out.append(INT_PAIR)
+        try:
+            out += PAIR.pack(*v)
+        except struct.error:
+            raise DoesNotFit
+    else:
+        raise DoesNotFit
+
+
+def unpack_value(data, i):
+    tag = data[i]
+    i += 1
+    if tag == INT:
+        return I64.unpack_from(data, i)[0], i + I64.size
+    if tag == STR:
+        return unpack_str(data, i)
+    if tag == NONE:
+        return None, i
+    if tag == TRUE:
+        return True, i
+    if tag == FALSE:
+        return False, i
+    if tag == FLOAT:
+        return F64.unpack_from(data, i)[0], i + F64.size
+    if tag == INT_PAIR:
+        return PAIR.unpack_from(data, i), i + PAIR.size
+    raise ValueError(f"unknown value tag {tag}")
+
+
+# Board snapshots, sent in new_game instead of the pickled game objects.
+#
+# A snapshot is a fixed header (version, game, rows, cols), the turn id and
+# both player ids as tagged values, then every cell in row-major order with
+# 2 bits per cell: 0 empty, 1 the first player, 2 the second player.
+
+BOARD_HEADER = struct.Struct("!BBBB")
+BOARD_VERSION = 1
+
+# game name -> (game number, attributes holding the two player ids, their marks)
+BOARD_GAMES = {
+    "tic_tac_toe": (0, ("X_id", "O_id"), ("X", "O")),
+    "connect4": (1, ("red_id", "blue_id"), ("red", "blue")),
+}
+BOARD_GAME_NAMES = {number: name for name, (number, _, _) in BOARD_GAMES.items()}
+
+
+class BoardSnapshot:
+    """A decoded board, with the same attributes as the server's game objects.
+
+    `cells` holds the mark on every cell in row-major order, or None where
+    the cell is empty.
+    """
+
+    def __init__(self, game, rows, cols, turn_id, first_id, second_id, cells=None):
+        self.game = game
+        self.rows, self.cols = rows, cols
+        self.turn_id = turn_id
+        first, second = BOARD_GAMES[game][1]
+        setattr(self, first, first_id)
+        setattr(self, second, second_id)
+        self.cells = cells if cells is not None else [None] * (rows * cols)
+
+
+def pack_board(snapshot):
+    number, (first, second), marks = BOARD_GAMES[snapshot.game]
+    out = bytearray(
+        BOARD_HEADER.pack(BOARD_VERSION, number, snapshot.rows, snapshot.cols)
+    )
+    pack_value(out, snapshot.turn_id)
+    pack_value(out, getattr(snapshot, first))
+    pack_value(out, getattr(snapshot, second))
+
+    codes = {None: 0, marks[0]: 1, marks[1]: 2}
+    cells = snapshot.cells
+    for i in range(0, len(cells), 4):
+        byte = 0
+        for shift, cell in enumerate(cells[i : i + 4]):
+            byte |= codes[cell] << (2 * shift)
+        out.append(byte)
+    return out
+
+
+def unpack_board(data):
+    version, number, rows, cols = BOARD_HEADER.unpack_from(data)
+    if version != BOARD_VERSION:
+        raise ValueError(f"unknown board snapshot version {version}")
+    i = BOARD_HEADER.size
+    turn_id, i = unpack_value(data, i)
+    first_id, i = unpack_value(data, i)
+    second_id, i = unpack_value(data, i)
+
+    game = BOARD_GAME_NAMES[number]
+    marks = (None,) + BOARD_GAMES[game][2]
+    cells = []
+    for byte in data[i : i + (rows * cols + 3) // 4]:
+        cells.extend(marks[(byte >> shift) & 3] for shift in (0, 2, 4, 6))
+    del cells[rows * cols :]
+
+    return BoardSnapshot(game, rows, cols, turn_id, first_id, second_id, cells)
@@ -0,0 +1,55 @@
+import pygame
+from constants import WIDTH, HEIGHT
+
+MAX_RECTS = 16  # past this many the marked rects are merged into one
+
+
+# Parts of the window that changed since the last frame
+class Dirty_Rects:
+    """Rects of the window, in window coordinates, that have to be redrawn.
+
+    Widgets mark what they change as it happens: a button its rect when it
+    gets hovered, a container its area when a page turns. The frame then
+    only redraws those parts and hands them to pygame.display.update(), so
+    a frame where nothing changed costs next to nothing.
+    """
+
+    def __init__(self, size=(WIDTH, HEIGHT)):
+        self.bounds = pygame.Rect((0, 0), size)
+        self.rects = []
+        self.everything = True  # the first frame draws the whole window
+
+    def __bool__(self):
+        return self.everything or len(self.rects) > 0
+
+    def mark(self, rect):
+        if self.everything:
+            return
+        rect = pygame.Rect(rect).clip(self.bounds)
+        if not rect.width or not rect.height:
+            return
+        if any(r.contains(rect) for r in self.rects):
+            return
+        self.rects.append(rect)
+        if len(self.rects) > MAX_RECTS:
+            self.rects = [self.rects[0].unionall(self.rects[1:])]
+
+    def mark_all(self):
+        self.everything = True
+        self.rects = []
+
+    def take(self):
+        """The rects to redraw this frame, and start over for the next one."""
+        rects = [self.bounds.copy()] if self.everything else self.rects
+        self.everything = False
+        self.rects = []
+        return rects
+
+
+# Function to limit drawing on a widget's own surface to the dirty part of
+# the surface it is blitted on at (x, y)
+def inherit_clip(surf, win, x=0, y=0):
+    surf.set_clip(win.get_clip().move(-x, -y))
+
+
+dirty_rects = Dirty_Rects()  # The one tracker every widget marks
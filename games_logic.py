@@ -1,5 +1,6 @@
 # just need a class named TTT_Logic from the file games_logic
 # hacky way to impress pickle
+# (only servers without board snapshots, see codec.unpack_board, still send these)
 class TTT_Logic:
     pass
 
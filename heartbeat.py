@@ -0,0 +1,51 @@
+import bisect
+from collections import deque
+
+HEARTBEAT_INTERVAL = 2  # seconds between two pings
+DEAD_PEER_TIMEOUT = 10  # seconds without hearing anything before the server counts as gone
+RTT_SAMPLES = 200  # round trips kept for the percentiles
+
+# upper edges of the histogram buckets, in seconds
+RTT_BUCKETS = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2)
+
+
+class RttHistogram:
+    """The last RTT_SAMPLES round trip times, for percentiles and a histogram.
+
+    Pongs are handled on the network thread, so these times don't include
+    any time the pygame loop spent drawing. A slow server shows up here, a
+    stalled client doesn't.
+    """
+
+    def __init__(self, size=RTT_SAMPLES):
+        self.samples = deque(maxlen=size)
+        self.last = None
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, rtt):
+        self.samples.append(rtt)
+        self.last = rtt
+
+    def percentile(self, p):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+    def histogram(self, edges=RTT_BUCKETS):
+        # number of samples at or under each edge, the last count is everything above
+        counts = [0] * (len(edges) + 1)
+        for rtt in self.samples:
+            counts[bisect.bisect_left(edges, rtt)] += 1
+        return counts
+
+    def stats(self):
+        return {
+            "samples": len(self.samples),
+            "last": self.last,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
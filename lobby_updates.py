@@ -0,0 +1,70 @@
+# message types that only change who is in the lobby, and can be merged
+LOBBY_MESSAGES = ("connected", "disconnected", "updated")
+
+
+class LobbyUpdates:
+    """Merges lobby messages per user id until the next layout pass.
+
+    A user who connects and leaves within the same window never becomes a
+    button, several renames collapse into one update and an update for a
+    user that just connected is folded into their details. flush() hands
+    back what is left, so the widgets can be laid out once for the whole
+    batch instead of once per message.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.removed = []  # ids that were in the lobby and have left
+        self.added = {}  # id -> details of users that joined, in order
+        self.changed = {}  # id -> merged changes for users already in the lobby
+        self.first_seen = {}  # id -> the first message about them in this window
+
+    def __len__(self):
+        return len(self.removed) + len(self.added) + len(self.changed)
+
+    # can this message wait for the next flush?
+    @staticmethod
+    def accepts(data):
+        return isinstance(data, dict) and len(data) > 0 and all(
+            key in LOBBY_MESSAGES for key in data
+        )
+
+    def add(self, data):
+        # same order and checks as the message handlers in the client
+        if data.get("connected"):
+            self.connected(data["connected"])
+        if data.get("disconnected"):
+            self.disconnected(data["disconnected"])
+        if data.get("updated"):
+            self.updated(data["updated"]["user_id"], data["updated"]["changed"])
+
+    def connected(self, user):
+        id = user["id"]
+        self.first_seen.setdefault(id, "connected")
+        self.changed.pop(id, None)
+        self.added.pop(id, None)  # joining again puts them at the end
+        self.added[id] = dict(user)
+
+    def disconnected(self, id):
+        self.first_seen.setdefault(id, "disconnected")
+        self.changed.pop(id, None)
+        self.added.pop(id, None)
+
+        # only users that were there before the window need a button removed
+        if self.first_seen[id] != "connected" and id not in self.removed:
+            self.removed.append(id)
+
+    def updated(self, id, changed):
+        self.first_seen.setdefault(id, "updated")
+        if id in self.added:
+            self.added[id].update(changed)
+        else:
+            self.changed.setdefault(id, {}).update(changed)
+
+    def flush(self):
+        """Return (removed ids, added users, {id: changes}) and start a new window."""
+        batch = self.removed, list(self.added.values()), self.changed
+        self.clear()
+        return batch
@@ -1,12 +1,254 @@
-import socket, pickle, struct, math
+import socket, pickle, struct, math, select, threading, time, hashlib
+from collections import deque
+from concurrent.futures import Future
+from heartbeat import RttHistogram
 
 DEFAULT_BYTES = 1024  # max bytes to be sent in one message
+RECV_BUFFER_SIZE = 64 * 1024  # bytes asked for in one recv_into call
+HEADER = struct.Struct("h")  # every frame starts with its length padded to 2 bytes
+
+# A large frame starts with LARGE_FRAME where a legacy frame has its length,
+# which can never be negative, followed by a flags byte and a 32 bit length.
+# It carries any payload in one piece instead of the 1 KiB "huge" batches.
+LARGE_FRAME = -1
+LARGE_HEADER = struct.Struct("!hBI")
+RAW = 1  # large frame flag: the body is raw bytes, not a pickle
+
+# With "channels", payloads on the bulk channel are cut into chunks, each in
+# a large frame with the CHUNK flag and the channel number after the header.
+# Ordinary frames are the interactive channel, and they can be sent between
+# two chunks, so a move never waits behind a whole avatar. The reciever
+# grants more bulk credit as it reads the chunks, so only BULK_WINDOW bytes
+# of bulk data are ever queued up in the sockets ahead of a move.
+CHUNK = 2  # large frame flag: the body is one chunk of a payload
+LAST = 4  # large frame flag: the chunk completes its payload
+CHANNEL = struct.Struct("!B")
+INTERACTIVE, BULK = 0, 1
+CHUNK_SIZE = 16 * 1024
+BULK_WINDOW = 256 * 1024  # bulk bytes that may be unread before the sender waits
+
+# optional protocol features the client understands. They are offered to the
+# server in the connection metadata, and only the ones it echoes back are used.
+FEATURES = (
+    "large_frames",
+    "board_snapshots",
+    "png_avatars",
+    "zlib_avatars",
+    "request_ids",
+    "channels",
+    "heartbeat",
+    "resume",
+    "lobby_pages",
+    "avatar_requests",
+    "avatar_hashes",
+    "uploads",
+)
+
+REQUEST_TIMEOUT = 10  # seconds to wait for the reply to a request
+
+
+class Transfer:
+    """Progress of a payload that is being sent in the background.
+
+    The network thread counts the bytes as the socket takes them, and the
+    pygame loop reads `sent` and `total` to draw the progress.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.sent = 0
+        self.future = None  # concurrent.futures.Future, True once everything is sent
+
+    @property
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def fraction(self):
+        return self.sent / self.total if self.total else 1
+
+    def result(self):
+        return self.future.result()
+
+
+# With "uploads" a big payload is announced with the hash of its bytes, and
+# the server answers with the offset to send it from: its whole size when it
+# already has it, as far as it got when an earlier upload was cut off, or 0.
+def payload_hash(data_bytes):
+    return hashlib.sha256(data_bytes).hexdigest()
+
+
+# the buffers of one chunk frame
+def chunk_frame(channel, chunk, pickled=True, last=True):
+    flags = CHUNK | (0 if pickled else RAW) | (LAST if last else 0)
+    return [
+        LARGE_HEADER.pack(LARGE_FRAME, flags, len(chunk)) + CHANNEL.pack(channel),
+        chunk,
+    ]
+
+
+# every buffer that has to be written to send one payload, in order
+def encode_frames(data_bytes, pickled=True, features=()):
+    size = len(data_bytes)
+    # raw bytes never go in a small frame, the reciever would try to decode them
+    if size < DEFAULT_BYTES and pickled:
+        return [HEADER.pack(size), data_bytes]
+
+    if "large_frames" in features:
+        return [LARGE_HEADER.pack(LARGE_FRAME, 0 if pickled else RAW, size), data_bytes]
+
+    # the old "huge" batches: a pickled header, the batch lengths, the batches
+    n_batches = math.ceil(size / DEFAULT_BYTES)
+    batch_lengths = [DEFAULT_BYTES] * (n_batches - 1) + [
+        size - (n_batches - 1) * DEFAULT_BYTES
+    ]
+    huge = pickle.dumps({"message_type": "huge", "n_batches": n_batches})
+    return [
+        HEADER.pack(len(huge)),
+        huge,
+        struct.pack("h" * n_batches, *batch_lengths),
+        data_bytes,
+    ]
+
+
+class FrameReader:
+    """Buffered reader that cuts the socket's byte stream into frames.
+
+    The reader owns one reusable receive buffer and fills it with large
+    `recv_into` calls, so several small frames usually arrive with a single
+    syscall and a frame split across TCP segments is never returned short.
+    The memoryviews it hands out point into that buffer and are only valid
+    until the next read.
+    """
+
+    def __init__(self, sock, size=RECV_BUFFER_SIZE):
+        self.sock = sock
+        self.buffer = bytearray(size)
+        self.start = 0  # first byte that has not been handed out yet
+        self.end = 0  # one past the last byte recieved
+
+        # counters, so the cost of every frame can be compared to the
+        # old two-recv-per-message path
+        self.frames = 0
+        self.syscalls = 0
+        self.bytes_read = 0
+        self.last_frame_syscalls = 0
+        self.last_frame_bytes = 0
+        self._frame_syscalls = 0
+        self._frame_bytes = 0
+
+    def _make_room(self, n):
+        # make sure n bytes fit after self.start, moving or growing the buffer
+        pending = self.end - self.start
+        if n > len(self.buffer):
+            buffer = bytearray(max(n, 2 * len(self.buffer)))
+            buffer[:pending] = self.buffer[self.start : self.end]
+            self.buffer = buffer
+        elif self.start + n > len(self.buffer):
+            self.buffer[:pending] = self.buffer[self.start : self.end]
+        else:
+            return
+        self.start, self.end = 0, pending
+
+    def buffered(self):
+        """Number of bytes recieved but not handed out yet."""
+        return self.end - self.start
+
+    def read_exact(self, n):
+        """Return a memoryview of exactly n bytes, or None if the peer closed."""
+        if self.end - self.start < n:
+            self._make_room(n)
+            view = memoryview(self.buffer)
+            while self.end - self.start < n:
+                recieved = self.sock.recv_into(view[self.end :])
+                self.syscalls += 1
+                self._frame_syscalls += 1
+                if not recieved:
+                    return None
+                self.end += recieved
+                self.bytes_read += recieved
+
+        data = memoryview(self.buffer)[self.start : self.start + n]
+        self.start += n
+        self._frame_bytes += n
+        if self.start == self.end:
+            self.start = self.end = 0
+        return data
+
+    def read_into(self, view):
+        """Fill a writable memoryview straight from the socket.
+
+        Large payloads skip the reusable buffer, so they are recieved into
+        their final, preallocated home without another copy.
+        """
+        buffered = min(self.end - self.start, len(view))
+        view[:buffered] = self.buffer[self.start : self.start + buffered]
+        self.start += buffered
+        if self.start == self.end:
+            self.start = self.end = 0
+
+        filled = buffered
+        while filled < len(view):
+            recieved = self.sock.recv_into(view[filled:])
+            self.syscalls += 1
+            self._frame_syscalls += 1
+            if not recieved:
+                return False
+            filled += recieved
+            self.bytes_read += recieved
+        self._frame_bytes += len(view)
+        return True
+
+    def read_header(self):
+        """Return (flags, length) of the next frame, or None if the peer closed."""
+        header = self.read_exact(HEADER.size)
+        if header is None:
+            return None
+        length = HEADER.unpack(header)[0]
+        if length != LARGE_FRAME:
+            return 0, length
+
+        rest = self.read_exact(LARGE_HEADER.size - HEADER.size)
+        if rest is None:
+            return None
+        return LARGE_HEADER.unpack(bytes(header) + bytes(rest))[1:]
+
+    def read_frame(self):
+        """Return the body of the next length-prefixed frame, or None if the peer closed."""
+        header = self.read_header()
+        if header is None:
+            return None
+        return self.read_exact(header[1])
+
+    def end_frame(self):
+        # close the books on the current frame
+        self.frames += 1
+        self.last_frame_syscalls = self._frame_syscalls
+        self.last_frame_bytes = self._frame_bytes
+        self._frame_syscalls = self._frame_bytes = 0
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "syscalls": self.syscalls,
+            "bytes": self.bytes_read,
+            "syscalls_per_frame": self.syscalls / self.frames if self.frames else 0,
+            "last_frame_syscalls": self.last_frame_syscalls,
+            "last_frame_bytes": self.last_frame_bytes,
+        }
 
 
 class Network:
     def __init__(self, ip=None, port=None):
+        self.init_state(ip, port)
         # initialise the client
         self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # every message is written in one go, so there is nothing for
+        # Nagle's algorithm to merge, it would only hold small moves back
+        self.client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = FrameReader(self.client)
+
+    # everything but the connection itself, AsyncNetwork starts with this too
+    def init_state(self, ip, port):
         self.server = (
             ip if ip is not None else input("Enter the IP address of the server: ")
         )  # the ip address of the server
@@ -18,6 +260,32 @@ class Network:
             self.port,
         )  # complete address, to which we can now connect to
         self.id = None
+        self.features = set()  # features the server agreed to
+
+        # requests waiting for their reply: request id -> (reply keys, Future)
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.last_request_id = 0
+        self.backlog = deque()  # messages read while waiting for a reply
+
+        # channels: payloads being put together and bulk credit in both directions
+        self.partial = {}  # channel -> bytearray of the chunks recieved so far
+        self.credit = {BULK: BULK_WINDOW}  # bytes we may still send on a channel
+        self.unacked = {BULK: 0}  # bytes read that the sender has no credit for yet
+
+        # frames queued by send_later(), written together by flush()
+        self.outbox = []
+        self.outbox_lock = threading.Lock()  # the network thread empties it too
+        self.writes = 0  # write syscalls
+        self.messages_sent = 0
+
+        # heartbeat
+        self.rtt = RttHistogram()
+        self.pings = {}  # number of a ping -> when it was sent
+        self.last_ping = 0
+        self.last_recieved = time.monotonic()
+        self.session = None  # token to resume the session with, from the server
+        self.handshake = None  # how long the steps of the last handshake took
 
     # function to connect to the server
     def connect(self):
@@ -29,8 +297,8 @@ class Network:
             data = self.recv()
             self.id = data  # the first element in the data will be the id
 
-            # no metadate needed to be sent
-            self.send({})
+            # the only metadata is the protocol features we can speak
+            self.send({"features": list(FEATURES)})
 
             return data
         except Exception as e:
@@ -38,71 +306,411 @@ class Network:
             print("error while trying to connect:", e)
             return False
 
-    # send some data to the server
-    def send(self, data, pickle_data=True, fn=lambda: None):
+    # are bulk payloads sent in chunks on a channel of their own?
+    def has_channels(self):
+        return "channels" in self.features and "large_frames" in self.features
+
+    # send some data to the server. Raw bytes go on the bulk channel unless
+    # another one is asked for.
+    def send(self, data, pickle_data=True, fn=lambda *args: None, channel=None):
         try:
+            self.flush()  # whatever was queued before goes first
+            self.messages_sent += 1
             if pickle_data:
                 data = pickle.dumps(data)
 
-            if len(data) >= DEFAULT_BYTES:
+            if channel is None:
+                channel = INTERACTIVE if pickle_data else BULK
+            if channel != INTERACTIVE and self.has_channels():
+                return self.send_chunks(channel, data, pickle_data, fn)
+
+            # raw bytes never go in a small frame, the reciever would try to decode them
+            if len(data) >= DEFAULT_BYTES or not pickle_data:
+                if "large_frames" in self.features:
+                    return self.send_large(data, pickle_data, fn)
                 return self.send_huge(data, fn)
 
-            self.client.sendall(struct.pack("h", len(data)))
-            self.client.sendall(data)
+            self.send_buffers([HEADER.pack(len(data)), data])
             return True
 
         except Exception as e:
             print("error while trying to send data:", e)
             return False
 
+    # queue a message to be written with the others of this frame by flush()
+    def send_later(self, data, pickle_data=True):
+        if not pickle_data:
+            return self.send(data, pickle_data)  # raw payloads have their own path
+        try:
+            data = pickle.dumps(data)
+            buffers = encode_frames(data, True, self.features)
+        except Exception as e:  # dropped, like send() drops what it can't send
+            print("error while trying to send data:", e)
+            return False
+        self.messages_sent += 1
+        with self.outbox_lock:
+            self.outbox.extend(buffers)
+        return True
+
+    # write every queued message in a single syscall
+    def flush(self):
+        if not self.outbox:
+            return True
+        with self.outbox_lock:
+            buffers, self.outbox = self.outbox, []
+        try:
+            self.send_buffers(buffers)
+            return True
+        except Exception as e:
+            print("error while trying to send data:", e)
+            return False
+
+    def send_stats(self):
+        return {
+            "messages": self.messages_sent,
+            "writes": self.writes,
+            "messages_per_write": self.messages_sent / self.writes if self.writes else 0,
+        }
+
+    # write several buffers with as few syscalls as possible
+    def send_buffers(self, buffers, fn=lambda *args: None):
+        if not hasattr(self.client, "sendmsg"):  # windows
+            self.client.sendall(b"".join(buffers))
+            self.writes += 1
+            return
+
+        views = [memoryview(b).cast("B") for b in buffers]
+        total = sum(len(v) for v in views)
+        done = 0
+        while views:
+            sent = self.client.sendmsg(views)
+            self.writes += 1
+            done += sent
+            while views and sent >= len(views[0]):
+                sent -= len(views.pop(0))
+            if views:
+                views[0] = views[0][sent:]
+            fn(done, total)
+
+    # send a payload of any size as one frame, header and body in a single write
+    def send_large(self, data_bytes, pickled=True, fn=lambda *args: None):
+        header = LARGE_HEADER.pack(
+            LARGE_FRAME, 0 if pickled else RAW, len(data_bytes)
+        )
+        self.send_buffers([header, data_bytes], fn)
+        return True
+
+    # send a payload in chunks, waiting for credit whenever the window is used up
+    def send_chunks(self, channel, data_bytes, pickled=True, fn=lambda *args: None):
+        view = memoryview(data_bytes).cast("B")
+        size = len(view)
+        for i in range(0, max(size, 1), CHUNK_SIZE):
+            chunk = view[i : i + CHUNK_SIZE]
+            self.wait_credit(channel, len(chunk))
+            self.send_buffers(chunk_frame(channel, chunk, pickled, i + CHUNK_SIZE >= size))
+            fn(i + len(chunk), size)
+        return True
+
+    def wait_credit(self, channel, n):
+        # the credit comes in as a message, so read until it does and keep
+        # every other message for recv()
+        while self.credit[channel] < n:
+            data = self.recv_frame()
+            if self.handle_protocol(data):
+                continue
+            self.backlog.append(data)
+            if not data:
+                raise ConnectionError("connection lost")
+        self.credit[channel] -= n
+
+    # add a chunk to its payload, returns the payload once it is complete
+    def add_chunk(self, channel, flags, chunk):
+        payload = self.partial.setdefault(channel, bytearray())
+        payload += chunk
+
+        if channel in self.unacked:
+            self.unacked[channel] += len(chunk)
+            # hand back credit in big steps instead of after every chunk
+            if self.unacked[channel] >= BULK_WINDOW // 2:
+                self.send_credit(channel, self.unacked[channel])
+                self.unacked[channel] = 0
+
+        if flags & LAST:
+            return self.partial.pop(channel)
+        return None
+
+    def send_credit(self, channel, n):
+        self.send({"credit": (channel, n)})
+
     # recieve some data from the server
     def recv(self, load=True):
+        if self.backlog:
+            return self.backlog.popleft()
+        while True:
+            data = self.recv_frame(load)
+            if not self.handle_protocol(data):
+                return data
+
+    # protocol messages are dealt with here and never reach the caller
+    def handle_protocol(self, data):
+        return self.handle_transport(data) or self.resolve_request(data)
+
+    # the connection's own traffic: heartbeats, credit and the handshake.
+    # Unlike replies to requests, the server doesn't number these.
+    def handle_transport(self, data):
+        if data:
+            self.last_recieved = time.monotonic()
+        if not isinstance(data, dict):
+            return False
+
+        if "ping" in data:
+            self.send_pong(data["ping"])
+            return True
+
+        if "session" in data:
+            self.session = data["session"]
+            return True
+
+        if "pong" in data:
+            sent = self.pings.pop(data["pong"], None)
+            if sent is not None:
+                self.rtt.add(time.monotonic() - sent)
+            return True
+
+        if "features" in data:
+            self.features = set(data["features"]) & set(FEATURES)
+            return True
+
+        if "credit" in data:
+            channel, n = data["credit"]
+            self.add_credit(channel, n)
+            return True
+
+        return False
+
+    def add_credit(self, channel, n):
+        self.credit[channel] = self.credit.get(channel, 0) + n
+
+    # ask the server for a pong, to time the round trip
+    def ping(self):
+        return self.send(self.next_ping())
+
+    def next_ping(self):
+        self.last_ping += 1
+        self.pings[self.last_ping] = time.monotonic()
+        # pongs that never came are lost, don't keep them around forever
+        for number in [n for n in self.pings if n <= self.last_ping - 16]:
+            del self.pings[number]
+        return {"ping": self.last_ping}
+
+    def send_pong(self, number):
+        self.send({"pong": number})
+
+    # has nothing, not even a pong, come from the server for `timeout` seconds?
+    def peer_silent(self, timeout):
+        return time.monotonic() - self.last_recieved > timeout
+
+    def connection_stats(self):
+        stats = self.rtt.stats()
+        stats["histogram"] = self.rtt.histogram()
+        stats["silent_for"] = time.monotonic() - self.last_recieved
+        stats["pings_lost"] = max(len(self.pings) - 1, 0)
+        stats["handshake"] = self.handshake
+        return stats
+
+    # send a message that expects a reply, returns a Future for that reply.
+    # Servers with "request_ids" echo the id of the request in the reply,
+    # older ones don't, so then the first message carrying `reply_key` (or
+    # one of them, for a tuple of keys) goes to the oldest request waiting
+    # for that key.
+    def start_request(self, data, reply_key):
+        future, data = self.add_request(data, reply_key)
+        if not self.send(data):
+            self.fail_request(future, ConnectionError("could not send the request"))
+        return future
+
+    # send a request and block until its reply comes, raises TimeoutError
+    def request(self, data, reply_key, timeout=REQUEST_TIMEOUT):
+        return self.wait_reply(self.start_request(data, reply_key), timeout)
+
+    # announce a payload with {key: details}, adding its size and for servers
+    # with "uploads" its hash. The reply gets the "offset" to send it from.
+    def offer_upload(self, key, details, data_bytes, reply_key, timeout=REQUEST_TIMEOUT):
+        future = self.start_offer(key, details, data_bytes, reply_key)
+        return self.upload_offset(self.wait_reply(future, timeout), data_bytes)
+
+    # the same without waiting, returns the Future of the reply for upload_offset()
+    def start_offer(self, key, details, data_bytes, reply_key):
+        details = {**details, "size": len(data_bytes)}
+        if "uploads" in self.features:
+            details["hash"] = payload_hash(data_bytes)
+        return self.start_request({key: details}, reply_key)
+
+    # the reply to an offer, with the "offset" to send the payload from
+    def upload_offset(self, reply, data_bytes):
+        offset = reply.get("offset", 0) if "uploads" in self.features else 0
+        reply["offset"] = min(max(int(offset), 0), len(data_bytes))
+        return reply
+
+    # send an offered payload from the offset the server asked for, returns
+    # a Transfer. This one blocks, so the Transfer is done when it returns.
+    def send_upload(self, data_bytes, offset=0):
+        transfer = Transfer(len(data_bytes))
+        transfer.future = Future()
+        sent = True
+        if offset < len(data_bytes):
+            sent = self.send(memoryview(data_bytes)[offset:], pickle_data=False)
+        transfer.sent = len(data_bytes) if sent else offset
+        transfer.future.set_result(sent)
+        return transfer
+
+    def wait_reply(self, future, timeout=REQUEST_TIMEOUT):
+        # nothing else reads this socket, so read until the reply turns up
+        # and keep every other message for recv()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not future.done():
+            if not self.reader.buffered():
+                wait = None if deadline is None else max(deadline - time.monotonic(), 0)
+                if not select.select([self.client], [], [], wait)[0]:
+                    self.forget_request(future)
+                    raise TimeoutError(f"no reply to request {future.request_id}")
+
+            data = self.recv_frame()
+            if self.handle_protocol(data):
+                continue
+            self.backlog.append(data)
+            if not data:  # server down, nothing will be answered
+                self.fail_pending(ConnectionError("connection lost"))
+        return future.result()
+
+    # register a request, returns its Future and the message to send for it
+    def add_request(self, data, reply_key):
+        future = Future()
+        with self.pending_lock:
+            self.last_request_id += 1
+            future.request_id = self.last_request_id
+            keys = (reply_key,) if isinstance(reply_key, str) else tuple(reply_key)
+            self.pending[future.request_id] = (keys, future)
+
+        if "request_ids" in self.features:
+            data = {**data, "request_id": future.request_id}
+        return future, data
+
+    def forget_request(self, future):
+        with self.pending_lock:
+            self.pending.pop(future.request_id, None)
+
+    def fail_request(self, future, error):
+        self.forget_request(future)
+        future.set_exception(error)
+
+    def fail_pending(self, error):
+        with self.pending_lock:
+            futures = [future for _, future in self.pending.values()]
+            self.pending.clear()
+        for future in futures:
+            future.set_exception(error)
+
+    # hand a reply to the request waiting for it, if there is one
+    def resolve_request(self, data):
+        if not self.pending or not isinstance(data, dict):
+            return False
+
+        with self.pending_lock:
+            if "request_id" in data:
+                entry = self.pending.pop(data["request_id"], None)
+                if entry is None:
+                    return True  # the reply to a request that timed out
+            else:
+                id = next(
+                    (
+                        id
+                        for id, (keys, _) in self.pending.items()
+                        if any(key in data for key in keys)
+                    ),
+                    None,
+                )
+                if id is None:
+                    return False
+                entry = self.pending.pop(id)
+
+        reply = {key: value for key, value in data.items() if key != "request_id"}
+        entry[1].set_result(reply)
+        return True
+
+    def recv_frame(self, load=True):
         data = None
         try:
-            lenData = self.client.recv(2)
-            #print(struct.unpack("h", lenData))
-            
-            if not lenData:
-                return ""  # server down
-            lenData = struct.unpack("h", lenData)[
-                0
-            ]  # length of data will be padded to 2  bytes
-            data = self.client.recv(lenData)
+            while True:
+                header = self.reader.read_header()
+                if header is None:
+                    return ""  # server down
 
+                flags, length = header
+                if flags & CHUNK:
+                    channel = self.reader.read_exact(CHANNEL.size)
+                    if channel is None:
+                        return ""  # server down
+                    channel = channel[0]
+                    chunk = self.reader.read_exact(length)
+                    if chunk is None:
+                        return ""  # server down
+                    data = self.add_chunk(channel, flags, chunk)
+                    if data is None:
+                        self.reader.end_frame()
+                        continue  # the rest of the payload comes in later frames
+                    if flags & RAW:
+                        return data
+                    break
 
-            try:
-                
-                pickled = pickle.loads(data)
-                
-                if isinstance(pickled, dict) and pickled.get("message_type") == "huge":
-                    n_batches = pickled["n_batches"]
-                    print("batches:",n_batches)
-                    binData = b""
-                    batch_sizes = struct.unpack(
-                        "h" * n_batches, self.client.recv(2 * n_batches)
-                    )
-                    print("batch size",batch_sizes)
-                    for size in batch_sizes:
-                        batchData = self.client.recv(size)
-
-                        if not batchData:
-                            return ""  # server down
+                if flags & RAW:
+                    body = bytearray(length)
+                    if not self.reader.read_into(memoryview(body)):
+                        return ""  # server down
+                    return body
 
-                        binData += batchData
+                data = self.reader.read_exact(length)
+                if data is None:
+                    return ""  # server down
+                break
 
-                    return binData
+            try:
+                message = pickle.loads(data)
+            except Exception:
+                if load:
+                    raise
+                return bytes(data)  # raw bytes that were never a message
 
-            except Exception as e:
-                print("error while trying to get huge data: ", e)
+            if isinstance(message, dict) and message.get("message_type") == "huge":
+                return self.recv_huge(message["n_batches"])
 
-            return pickle.loads(data) if load else data
+            return message if load else bytes(data)
 
         except Exception as e:
             print("error while recieving:", e)
             # print(data)
             return False
+        finally:
+            self.reader.end_frame()
+
+    # the old way of recieving big payloads, kept for servers without large frames
+    def recv_huge(self, n_batches):
+        sizes = self.reader.read_exact(2 * n_batches)
+        if sizes is None:
+            return ""  # server down
+        batch_sizes = struct.unpack("h" * n_batches, sizes)
+
+        binData = bytearray(sum(batch_sizes))
+        view = memoryview(binData)
+        offset = 0
+        for size in batch_sizes:
+            if not self.reader.read_into(view[offset : offset + size]):
+                return ""  # server down
+            offset += size
+
+        return binData
 
-    def send_huge(self, data_bytes, fn=lambda: None):
+    def send_huge(self, data_bytes, fn=lambda *args: None):
 
         size = len(data_bytes)
         n_batches = math.ceil(size / DEFAULT_BYTES)
@@ -0,0 +1,56 @@
+from collections import OrderedDict
+
+
+class SurfaceCache:
+    """Surfaces that are expensive to make and get drawn over and over.
+
+    Entries are kept by a key that says everything the surface was made
+    from, so a changed look is a different key and nothing has to be told to
+    forget anything. When the entries take more than max_bytes the least
+    recently used ones are dropped.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, bytes), least recently used first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value, nbytes):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        self.entries[key] = (value, nbytes)
+        self.size += nbytes
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, (_, dropped) = self.entries.popitem(last=False)
+            self.size -= dropped
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+        }
+
+
+# bytes a surface takes, close enough for keeping caches under a limit
+def surface_bytes(surf):
+    return surf.get_pitch() * surf.get_height()
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The modules sit at the top of the repo, and constants loads the static
+# files relative to it, without a window or sound card
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
@@ -0,0 +1,93 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from async_network import AsyncNetwork
+from network import HEADER, FrameReader, Network
+
+
+# A server on a thread of its own, going through the handshake and then
+# running the test's script on a Network for its end of the connection
+@pytest.fixture
+def serve():
+    srv = socket.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen()
+    clients = []
+
+    def start(script):
+        def run():
+            sock, _ = srv.accept()
+            peer = Network("", 0)
+            peer.client.close()
+            peer.client, peer.reader = sock, FrameReader(sock)
+            peer.send(1)
+            peer.recv_frame()  # the metadata
+            peer.send({"users": {}})
+            script(peer)
+
+        threading.Thread(target=run, daemon=True).start()
+        n = AsyncNetwork("127.0.0.1", srv.getsockname()[1])
+        clients.append(n)
+        assert n.connect() == 1
+        assert n.recv(timeout=5) == {"users": {}}
+        return n
+
+    yield start
+    for n in clients:
+        n.close()
+    srv.close()
+
+
+def test_replies_count_for_the_replay(serve):
+    done = threading.Event()
+
+    def script(peer):
+        peer.send({"ping": 1})  # not numbered by the server
+        peer.send({"disconnected": 3})
+        peer.recv()  # the request
+        peer.send({"image_allowed": True})
+        peer.send({"disconnected": 4})
+        done.wait(5)
+
+    n = serve(script)
+    reply = n.request({"image": {"size": 1}}, "image_allowed", timeout=5)
+    assert reply == {"image_allowed": True}
+    assert n.recv(timeout=5) == {"disconnected": 3}
+    assert n.recv(timeout=5) == {"disconnected": 4}
+    # the lobby, both messages and the reply
+    assert n.recieved == 4
+    done.set()
+
+
+def test_undecodable_message_is_skipped(serve):
+    done = threading.Event()
+
+    def script(peer):
+        junk = b"\x80\x04garbage"
+        peer.client.sendall(HEADER.pack(len(junk)) + junk)
+        peer.send({"disconnected": 4})
+        done.wait(5)
+
+    n = serve(script)
+    assert n.recv(timeout=5) == {"disconnected": 4}
+    assert n.online  # no reconnecting for it
+    done.set()
+
+
+def test_request_doesnt_wait_for_a_legacy_upload(serve):
+    done = threading.Event()
+
+    def script(peer):
+        done.wait(10)  # reads nothing, so the upload stays stuck in the socket
+
+    n = serve(script)
+    upload = n.send_in_background(bytes(32 * 1024 * 1024))
+    time.sleep(0.2)
+    started = time.monotonic()
+    future = n.start_offer("image", {}, b"image", "image_allowed")
+    assert time.monotonic() - started < 1
+    assert not future.done() and not upload.done
+    done.set()
@@ -0,0 +1,49 @@
+import pytest
+
+import codec
+
+VALUES = [None, True, False, 0, -1, 2 ** 63 - 1, 1.5, "", "someone", "ünïcödé", (3, 7), "x" * 65535]
+
+
+@pytest.mark.parametrize("value", VALUES)
+def test_value_round_trip(value):
+    out = bytearray()
+    codec.pack_value(out, value)
+    assert codec.unpack_value(out, 0) == (value, len(out))
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "x" * 65536,  # too long for the 16 bit length of a string
+        "\udc80",  # lone surrogates have no utf-8
+        2 ** 70,
+        (1, 2 ** 70),
+        (1, 2, 3),
+        [1, 2],
+        b"bytes",
+    ],
+)
+def test_value_does_not_fit(value):
+    with pytest.raises(codec.DoesNotFit):
+        codec.pack_value(bytearray(), value)
+
+
+def test_board_snapshot_round_trip():
+    snapshot = codec.BoardSnapshot("connect4", 12, 13, 2, 1, 2)
+    snapshot.cells[0] = "red"
+    snapshot.cells[-1] = "blue"
+    board = codec.unpack_board(codec.pack_board(snapshot))
+    assert (board.rows, board.cols, board.turn_id) == (12, 13, 2)
+    assert (board.red_id, board.blue_id) == (1, 2)
+    assert board.cells == snapshot.cells
+
+
+def test_tic_tac_toe_snapshot():
+    snapshot = codec.BoardSnapshot("tic_tac_toe", 3, 3, "7", "7", None)
+    snapshot.cells[4] = "X"
+    data = codec.pack_board(snapshot)
+    assert len(data) < 30
+    board = codec.unpack_board(data)
+    assert (board.X_id, board.O_id, board.turn_id) == ("7", None, "7")
+    assert board.cells == snapshot.cells
@@ -0,0 +1,149 @@
+import pickle
+import socket
+import threading
+
+import pytest
+
+from network import (
+    BULK,
+    DEFAULT_BYTES,
+    RAW,
+    FrameReader,
+    Network,
+    chunk_frame,
+    encode_frames,
+)
+
+
+class Trickle:
+    """A socket that hands out what was sent a few bytes at a time."""
+
+    def __init__(self, data, step=3):
+        self.data = bytes(data)
+        self.step = step
+
+    def recv_into(self, view):
+        n = min(len(view), self.step, len(self.data))
+        view[:n] = self.data[:n]
+        self.data = self.data[n:]
+        return n
+
+
+def wire(*buffer_lists):
+    return b"".join(bytes(b) for buffers in buffer_lists for b in buffers)
+
+
+def frames(message, features=()):
+    return encode_frames(pickle.dumps(message), True, features)
+
+
+class Peer:
+    """The server end of a socket pair, writing on a thread of its own so
+    payloads bigger than the socket buffers don't block the test."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.threads = []
+
+    def sendall(self, data):
+        thread = threading.Thread(target=self.sock.sendall, args=(data,), daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+
+@pytest.fixture
+def peers():
+    # a Network reading one end of a socket pair, the test writes the other
+    a, b = socket.socketpair()
+    a.settimeout(5)
+    n = Network("", 0)
+    n.client.close()
+    n.client, n.reader = a, FrameReader(a)
+    peer = Peer(b)
+    yield n, peer
+    for thread in peer.threads:
+        thread.join(5)
+    a.close()
+    b.close()
+
+
+def test_small_frames_share_one_read():
+    messages = [{"move": {"game_id": 1, "move": i}} for i in range(20)]
+    reader = FrameReader(Trickle(wire(*(frames(m) for m in messages)), step=1 << 20))
+    got = [pickle.loads(reader.read_frame()) for _ in messages]
+    assert got == messages
+    assert reader.syscalls == 1
+
+
+def test_frame_split_across_reads():
+    message = {"connected": {"id": 3, "username": "someone", "color": (1, 2, 3)}}
+    reader = FrameReader(Trickle(wire(frames(message)), step=3))
+    assert pickle.loads(reader.read_frame()) == message
+    assert reader.syscalls > 1
+
+
+def test_frame_larger_than_the_buffer():
+    message = {"updated": {"user_id": 2, "changed": {"username": "y" * 500}}}
+    reader = FrameReader(Trickle(wire(frames(message)), 70), size=64)
+    assert pickle.loads(reader.read_frame()) == message
+
+
+def test_peer_closed_mid_frame():
+    reader = FrameReader(Trickle(wire(frames({"disconnected": 4}))[:-1]))
+    assert reader.read_frame() is None
+
+
+def test_legacy_frames(peers):
+    n, peer = peers
+    messages = [{"disconnected": 4}, {"moved": {"to": 3, "turn_string": "X", "turn_id": 2}}]
+    peer.sendall(wire(*(frames(m) for m in messages)))
+    assert [n.recv(), n.recv()] == messages
+
+
+def test_large_frames(peers):
+    n, peer = peers
+    message = {"updated": {"user_id": 2, "changed": {"username": "y" * (4 * DEFAULT_BYTES)}}}
+    image = bytes(range(256)) * 1000
+    peer.sendall(wire(
+        frames(message, ("large_frames",)),
+        encode_frames(image, False, ("large_frames",)),
+    ))
+    assert n.recv() == message
+    assert n.recv(load=False) == image
+
+
+def test_large_frame_header():
+    data = b"x" * 5000
+    reader = FrameReader(Trickle(wire(encode_frames(data, False, ("large_frames",))), 700), size=64)
+    flags, length = reader.read_header()
+    assert flags & RAW and length == len(data)
+    assert bytes(reader.read_exact(length)) == data
+
+
+def test_chunks_with_interactive_frames_between(peers):
+    n, peer = peers
+    payload = bytes(range(256)) * 200
+    chunks = [payload[i : i + 16000] for i in range(0, len(payload), 16000)]
+    move = {"move": {"game_id": 1, "move": 4}}
+
+    buffers = []
+    for i, chunk in enumerate(chunks):
+        buffers.append(chunk_frame(BULK, chunk, pickled=False, last=i == len(chunks) - 1))
+        if i == 0:
+            buffers.append(frames(move))  # a move doesn't wait for the payload
+    peer.sendall(wire(*buffers))
+
+    assert n.recv() == move
+    assert bytes(n.recv(load=False)) == payload
+    assert BULK not in n.partial
+
+
+def test_chunked_message(peers):
+    n, peer = peers
+    message = {"users": {i: {"id": i, "username": f"user{i}"} for i in range(500)}}
+    data = pickle.dumps(message)
+    peer.sendall(wire(
+        chunk_frame(BULK, data[:1000], last=False),
+        chunk_frame(BULK, data[1000:]),
+    ))
+    assert n.recv() == message
@@ -0,0 +1,90 @@
+from lobby_updates import LobbyUpdates
+
+
+def user(id, username=None):
+    return {"id": id, "username": username or f"user{id}", "color": (id, id, id)}
+
+
+def merged(*messages):
+    updates = LobbyUpdates()
+    for message in messages:
+        assert LobbyUpdates.accepts(message)
+        updates.add(message)
+    return updates.flush()
+
+
+def test_connect_update_disconnect_leaves_nothing():
+    removed, added, changed = merged(
+        {"connected": user(5)},
+        {"updated": {"user_id": 5, "changed": {"username": "renamed"}}},
+        {"disconnected": 5},
+    )
+    assert (removed, added, changed) == ([], [], {})
+
+
+def test_update_of_a_new_user_goes_into_their_details():
+    removed, added, changed = merged(
+        {"connected": user(5)},
+        {"updated": {"user_id": 5, "changed": {"username": "renamed"}}},
+        {"updated": {"user_id": 5, "changed": {"bot": True}}},
+    )
+    assert removed == [] and changed == {}
+    assert added == [{**user(5), "username": "renamed", "bot": True}]
+
+
+def test_renames_of_a_user_already_there_collapse():
+    removed, added, changed = merged(
+        {"updated": {"user_id": 2, "changed": {"username": "a"}}},
+        {"updated": {"user_id": 2, "changed": {"username": "b", "bot": False}}},
+    )
+    assert (removed, added) == ([], [])
+    assert changed == {2: {"username": "b", "bot": False}}
+
+
+def test_update_then_disconnect_only_removes():
+    removed, added, changed = merged(
+        {"updated": {"user_id": 2, "changed": {"username": "a"}}},
+        {"disconnected": 2},
+    )
+    assert (removed, added, changed) == ([2], [], {})
+
+
+def test_leaving_and_coming_back_replaces_the_button():
+    removed, added, changed = merged(
+        {"disconnected": 2},
+        {"connected": user(2, "back")},
+    )
+    assert removed == [2]
+    assert added == [user(2, "back")]
+    assert changed == {}
+
+
+def test_joins_keep_their_order_and_rejoining_goes_last():
+    removed, added, changed = merged(
+        {"connected": user(1)},
+        {"connected": user(2)},
+        {"connected": user(3)},
+        {"disconnected": 1},
+        {"connected": user(1)},
+    )
+    assert removed == []
+    assert [u["id"] for u in added] == [2, 3, 1]
+
+
+def test_flush_starts_a_new_window():
+    updates = LobbyUpdates()
+    updates.add({"connected": user(5)})
+    assert len(updates) == 1
+    updates.flush()
+    assert len(updates) == 0
+
+    # user 5 is in the lobby now, so leaving takes their button away
+    updates.add({"disconnected": 5})
+    assert updates.flush() == ([5], [], {})
+
+
+def test_only_lobby_messages_wait():
+    assert LobbyUpdates.accepts({"connected": user(1), "disconnected": 2})
+    assert not LobbyUpdates.accepts({"connected": user(1), "move": 3})
+    assert not LobbyUpdates.accepts({})
+    assert not LobbyUpdates.accepts("")
@@ -0,0 +1,71 @@
+import random
+import string
+
+import pygame
+import pytest
+
+import text_fit
+from text_fit import ELLIPSIS, fit_text
+
+
+@pytest.fixture(scope="module")
+def font():
+    pygame.font.init()
+    return pygame.font.Font(None, 28)
+
+
+# what fit_text replaced: take off one character at a time until it fits
+def one_at_a_time(font, text, width):
+    if font.size(text)[0] > width:
+        while text and font.size(text + ELLIPSIS)[0] > width:
+            text = text[:-1]
+        text += ELLIPSIS
+    return text
+
+
+def test_short_text_is_left_alone(font):
+    assert fit_text(font, "bob", 200) == "bob"
+    assert fit_text(font, "", 200) == ""
+
+
+def test_long_text_is_cut(font):
+    text = "a_really_long_username_that_never_fits" * 3
+    fitted = fit_text(font, text, 150)
+    assert fitted.endswith(ELLIPSIS)
+    assert text.startswith(fitted[: -len(ELLIPSIS)])
+    assert font.size(fitted)[0] <= 150
+    # one more character would not have fit
+    longer = text[: len(fitted) - len(ELLIPSIS) + 1] + ELLIPSIS
+    assert font.size(longer)[0] > 150
+
+
+def test_nothing_fits(font):
+    assert fit_text(font, "Wide Wide Wide", 5) == ELLIPSIS
+
+
+@pytest.mark.parametrize("width", [40, 90, 150, 260])
+def test_same_as_one_at_a_time(font, width):
+    rng = random.Random(width)
+    chars = string.ascii_letters + string.digits + " _-.W"
+    for _ in range(200):
+        text = "".join(rng.choice(chars) for _ in range(rng.randint(1, 80)))
+        assert fit_text(font, text, width) == one_at_a_time(font, text, width)
+
+
+def test_results_are_remembered(font, monkeypatch):
+    text = "remember me, I am much too long to fit" * 2
+    fitted = fit_text(font, text, 120)
+    assert (font, text, 120) in text_fit.fitted
+
+    # the second time nothing is measured
+    monkeypatch.setattr(text_fit, "longest_fitting_prefix", None)
+    assert fit_text(font, text, 120) == fitted
+
+
+def test_remembers_a_limited_number(font, monkeypatch):
+    monkeypatch.setattr(text_fit, "MAX_FITTED", 10)
+    monkeypatch.setattr(text_fit, "fitted", type(text_fit.fitted)())
+    for i in range(30):
+        fit_text(font, f"text {i}", 500)
+    assert len(text_fit.fitted) == 10
+    assert (font, "text 29", 500) in text_fit.fitted
@@ -0,0 +1,31 @@
+from surface_cache import SurfaceCache, surface_bytes
+
+TEXT_CACHE_BYTES = 8 * 1024 * 1024  # thousands of labels, counters and usernames
+
+# Rendered text, by (font, text, antialias, color, background)
+text_surfaces = SurfaceCache(TEXT_CACHE_BYTES)
+
+
+def cached_render(font, text, antialias, color, background=None):
+    """font.render() that keeps what it rendered.
+
+    Labels, counters and button texts go back and forth between the same
+    few strings, so most renders are a lookup. Everyone rendering the same
+    text gets the same surface, so it must not be drawn on. Only for the
+    pygame thread, like font.render() itself.
+    """
+    key = (
+        font,
+        text,
+        bool(antialias),
+        tuple(color),
+        None if background is None else tuple(background),
+    )
+    surf = text_surfaces.get(key)
+    if surf is None:
+        if background is None:
+            surf = font.render(text, antialias, color)
+        else:
+            surf = font.render(text, antialias, color, background)
+        text_surfaces.put(key, surf, surface_bytes(surf))
+    return surf
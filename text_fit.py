@@ -0,0 +1,77 @@
+from collections import OrderedDict
+from itertools import accumulate
+
+ELLIPSIS = "..."
+MAX_FITTED = 4096  # (font, text, width) results kept, a few lobbies worth of usernames
+
+advances = {}  # font -> {character: advance in pixels}
+fitted = OrderedDict()  # (font, text, width) -> fitted text, least recently used first
+
+
+# The advance of every character in text, measured once per font and character
+def glyph_advances(font, text):
+    table = advances.setdefault(font, {})
+    widths = []
+    for c in text:
+        if c not in table:
+            metrics = font.metrics(c)[0]
+            # Characters the font has no glyph for are as wide as they render
+            table[c] = metrics[4] if metrics else font.size(c)[0]
+        widths.append(table[c])
+    return widths
+
+
+def fit_text(font, text, width):
+    """The text, or the longest start of it followed by "..." that is no
+    wider than width.
+
+    The same as taking off one character at a time until it fits, but the
+    glyph advances give a first guess and a binary search checks it with
+    font.size(), so a long text takes a few measurements instead of one
+    per character. Results are remembered per font, text and width.
+    """
+    key = (font, text, width)
+    if key in fitted:
+        fitted.move_to_end(key)
+        return fitted[key]
+
+    if font.size(text)[0] <= width:
+        result = text
+    else:
+        result = text[: longest_fitting_prefix(font, text, width)] + ELLIPSIS
+
+    fitted[key] = result
+    if len(fitted) > MAX_FITTED:
+        fitted.popitem(last=False)
+    return result
+
+
+# Number of characters of text that fit in width with the ellipsis after them,
+# 0 when not even the ellipsis fits. The whole text is known not to fit.
+def longest_fitting_prefix(font, text, width):
+    def fits(n):
+        return font.size(text[:n] + ELLIPSIS)[0] <= width
+
+    # Advances leave out kerning and overhangs, so they only pick where to look
+    room = width - sum(glyph_advances(font, ELLIPSIS))
+    guess = sum(1 for w in accumulate(glyph_advances(font, text)) if w <= room)
+
+    # The answer is in [lo, hi]
+    lo, hi = 0, len(text) - 1
+    guess = min(max(guess, lo), hi)
+    if fits(guess):
+        lo = guess
+        if guess < hi and not fits(guess + 1):
+            return guess
+    else:
+        hi = guess - 1
+        if hi > lo and fits(hi):
+            return hi
+
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if fits(mid):
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
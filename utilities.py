@@ -1,6 +1,9 @@
 from constants import *
 import pygame
 from button import Button
+from dirty_rects import dirty_rects, inherit_clip
+from text_cache import cached_render
+from text_fit import fit_text
 from animated_backgrounds import *
 import random
 import pyperclip
@@ -93,18 +96,27 @@ class Text_Input:
 
     def clear(self):
         self.text = ""  # Clear the text input
+        dirty_rects.mark(self.rect)
 
     def check_keys(self, keys):
         # Handle backspace and delete key presses
         if (keys[pygame.K_DELETE] or keys[pygame.K_BACKSPACE]) and self.selected:
             if len(self.text) > 0:
                 self.text = self.text[:-1]
+                dirty_rects.mark(self.rect)
                 if saved_settings["sound_effects"]:
                     Sound_Effects.key_delete.stop()
                     Sound_Effects.key_delete.play()
 
     def check_event(self, e):
         # Check and handle events for the text input
+        before = (self.text, self.selected, self.hovered)
+        self.handle_event(e)
+        # Redraw the field when what it shows has changed
+        if (self.text, self.selected, self.hovered) != before:
+            dirty_rects.mark(self.rect)
+
+    def handle_event(self, e):
         self.check_hover()
         self.clear_button.check_event(e)
 
@@ -161,6 +173,7 @@ class Text_Input:
 
     def draw(self, win):
         # Draw the input field
+        inherit_clip(self.surf, win, self.x, self.y)
         self.surf.fill(self.bg_color)
 
         if self.selected:
@@ -170,12 +183,12 @@ class Text_Input:
             self.surf.fill(self.hover_color)
 
         if len(self.text) > 0:
-            text_render = self.font.render(self.text, False, self.font_color)
+            text_render = cached_render(self.font, self.text, False, self.font_color)
             text_rect = text_render.get_rect(center=(self.w / 2, (self.h) / 2))
             self.surf.blit(text_render, text_rect)
         elif len(self.default_text) > 0:
-            text_render = self.font.render(
-                self.default_text, False, Colors.GRAY)
+            text_render = cached_render(
+                self.font, self.default_text, False, Colors.GRAY)
             text_rect = text_render.get_rect(center=(self.w / 2, (self.h) / 2))
             self.surf.blit(text_render, text_rect)
 
@@ -186,6 +199,7 @@ class Text_Input:
     def update(self, changed):
         # Update the text input properties
         self.__dict__.update(changed)
+        dirty_rects.mark(self.rect)
 
 
 # Class to handle navigation buttons (previous, next, home, settings)
@@ -244,26 +258,29 @@ class Navigators:
         self.reposition_buttons()
 
     def update_buttons(self, current_page, displays):
-        # Enable or disable buttons based on the current page and display
-        for button in self.buttons:
-            button.disable()
-
-        if current_page > 0:
+        # Enable or disable buttons based on the current page and display,
+        # each one set once so only the ones that change get redrawn
+        enabled = [
             # Enable previous button if not on the first page
-            self.buttons[0].enable()
-        if current_page < len(displays) - 1:
+            current_page > 0,
             # Enable next button if not on the last page
-            self.buttons[1].enable()
-        if displays[current_page] != "home":
+            current_page < len(displays) - 1,
             # Enable home button if not on the home page
-            self.buttons[2].enable()
-
-        if displays[current_page] != "settings":
+            displays[current_page] != "home",
             # Enable settings button if not on the settings page
-            self.buttons[3].enable()
+            displays[current_page] != "settings",
+        ]
+        for button, enable in zip(self.buttons, enabled):
+            if enable:
+                button.enable()
+            else:
+                button.disable()
 
     def draw(self, win):
         # Update and draw each button
+        inherit_clip(self.surf, win, self.x, self.y)
+        # Clear what was drawn last time, the button images are see through
+        self.surf.fill(Colors.BLACK)
         for button in self.buttons:
             button.update(self.surf)
         win.blit(self.surf, (self.x, self.y))
@@ -285,6 +302,95 @@ class Navigators:
             button.check_event(e)
 
 
+# Thin bar showing how far along a background job is
+class Progress_Bar:
+    def __init__(self, x, y, w, h, color=Colors.GREEN, bg_color=Colors.GRAY):
+        self.rect = pygame.Rect(x, y, w, h)
+        self.color = color
+        self.bg_color = bg_color
+
+    def draw(self, win, fraction):
+        # Draw the empty bar, then the done part of it on top
+        pygame.draw.rect(win, self.bg_color, self.rect)
+        done = self.rect.copy()
+        done.width = round(self.rect.width * min(max(fraction, 0), 1))
+        pygame.draw.rect(win, self.color, done)
+
+
+# Small readout of the connection quality, next to the navigation buttons
+class Connection_Indicator:
+    refresh_every = 0.5  # Seconds between two updates of the text
+
+    def __init__(self, x, y, font=Fonts.tiny_font, color=Colors.BLACK,
+                 bg_color=Colors.LIGHT_BROWN):
+        self.x, self.y = x, y  # Top right corner
+        self.font = font
+        self.color = color
+        self.bg_color = bg_color
+        self.text = None
+        self.surf = None
+        self.rect = None  # Part of the pane it covers, dot included
+        self.dot_color = Colors.GRAY
+        self.last_refresh = 0
+        self.status = None  # Shown instead of the numbers, while reconnecting
+
+    def set_status(self, status):
+        self.status = status
+        self.last_refresh = 0  # Redraw the text straight away
+
+    def update(self, stats, frame_time):
+        # Round trip from the network thread, frame time from the pygame loop,
+        # so a slow server and a stalled client don't look the same
+        if self.status is not None:
+            text = self.status
+            dot_color = Colors.RED
+        elif stats["p50"] is None:
+            text = f"ping -  frame {frame_time} ms"
+            dot_color = Colors.GRAY
+        else:
+            p50, p95 = round(stats["p50"] * 1000), round(stats["p95"] * 1000)
+            text = f"ping {p50}/{p95} ms  frame {frame_time} ms"
+            if stats["p95"] < 0.1:
+                dot_color = Colors.GREEN
+            elif stats["p95"] < 0.25:
+                dot_color = Colors.YELLOW
+            else:
+                dot_color = Colors.RED
+
+        if (text, dot_color) == (self.text, self.dot_color) and self.surf:
+            return False
+        self.text, self.dot_color = text, dot_color
+        self.surf = cached_render(self.font, text, True, self.color, self.bg_color)
+        return True
+
+    def refresh(self, stats_fn, frame_time):
+        """Update the text every refresh_every seconds, returns the part of
+        the pane that has to be redrawn, or None when nothing changed."""
+        now = time.time()
+        if now - self.last_refresh < self.refresh_every:
+            return None
+        self.last_refresh = now
+        if not self.update(stats_fn(), frame_time):
+            return None
+
+        # The text ends at the corner, with the dot in front of it
+        old_rect = self.rect
+        text_rect = self.surf.get_rect(topright=(self.x, self.y))
+        radius = text_rect.height // 3
+        self.rect = text_rect.inflate(2 * radius + 8, 0).move(-radius - 4, 0)
+        return self.rect.union(old_rect) if old_rect else self.rect
+
+    def draw(self, win):
+        if self.surf is None:
+            return
+        text_rect = self.surf.get_rect(topright=(self.x, self.y))
+        radius = text_rect.height // 3
+        pygame.draw.rect(win, self.bg_color, self.rect)
+        win.blit(self.surf, text_rect)
+        pygame.draw.circle(
+            win, self.dot_color, (text_rect.x - radius - 2, text_rect.centery), radius)
+
+
 # Base class for a notification
 class Notification:
     def __init__(
@@ -322,7 +428,7 @@ class Notification:
 
         # Render the title and its rectangle for positioning
         title = self.truncate(title, self.title_font)
-        self.title = self.title_font.render(title, False, title_color)
+        self.title = cached_render(self.title_font, title, False, title_color)
         self.title_rect = self.title.get_rect(
             center=(self.w / 2, self.title.get_height() / 2 + 5)
         )
@@ -331,7 +437,7 @@ class Notification:
         self.text = None
         if text:
             text = self.truncate(text, self.text_font)
-            self.text = self.text_font.render(text, False, text_color)
+            self.text = cached_render(self.text_font, text, False, text_color)
             self.text_rect = self.text.get_rect(
                 center=(
                     self.w / 2,
@@ -360,11 +466,7 @@ class Notification:
 
     def truncate(self, text, font):
         # Truncate text to fit within the width of the notification
-        if font.size(text)[0] > self.w:
-            while font.size(text + "...")[0] > self.w:
-                text = text[:-1]
-            text += "..."
-        return text
+        return fit_text(font, text, self.w)
 
     def create_buttons(self):
         # Create buttons based on provided properties
@@ -425,6 +527,7 @@ class Notification:
 
     def draw(self, win):
         # Draw the notification on the given surface
+        inherit_clip(self.surf, win, self.x, self.y)
         self.surf.fill(self.override_color or self.color)
         self.surf.blit(self.title, self.title_rect)
         if self.text:
@@ -470,8 +573,11 @@ class UserButton:
         self.color = color
         self.rect = pygame.Rect((x, y, w, h))
         self.username = text
-        self.image = pygame.surfarray.make_surface(
-            image) if image is not None else None
+        # Images that arrived after the user joined are already surfaces
+        if image is None or isinstance(image, pygame.Surface):
+            self.image = image
+        else:
+            self.image = pygame.surfarray.make_surface(image)
 
         # Set up button style
         self.button_style = Button_Styles.USER_BUTTON_STYLE.copy()
@@ -508,11 +614,40 @@ class UserButton:
         """Update the button display on the window."""
         self.button.update(win)
 
+    def move(self, page, row, col, rect):
+        """Move the button to a new slot without rebuilding it."""
+        self.page, self.row, self.col = page, row, col
+        self.rect = pygame.Rect(rect)
+
+        # Nothing about its looks depends on where it is, so just shift it
+        dx = self.rect.x - self.button.rect.x
+        dy = self.rect.y - self.button.rect.y
+        self.button.rect = pygame.Rect(self.rect)
+        for _, tag_rect in self.button.tag_surfs:
+            tag_rect.move_ip(dx, dy)
+
+    def set_avatar(self, avatar):
+        """Swap in an avatar that was already scaled and measured off the main thread."""
+        self.image = avatar.button_image
+        self.avg_color = avatar.avg_color
+        self.text_color = avatar.text_color
+        self.button_style["font_color"] = self.text_color
+
+        self.button = Button(
+            self.rect,
+            self.color,
+            self.click,
+            text=self.username,
+            image=self.image,
+            **self.button_style,
+        )
+
     def update(self, changed: dict):
         """Update button properties and recalculate styles based on new data."""
         self.__dict__.update(changed)
         self.rect = pygame.Rect(self.rect)
-        if self.image:
+        # Scaling and measuring an avatar is slow, so only a new one is
+        if changed.get("image"):
             self.image = pygame.transform.scale(
                 self.image, (int(self.w), int(self.h)))
 
@@ -539,6 +674,11 @@ class UserButton:
             self.text_color = [255 - c for c in self.avg_color]
 
             self.button_style["font_color"] = self.text_color
+        elif not self.image:
+            # No image, or it was dropped: the plain color
+            self.avg_color = self.color
+            self.text_color = [255 - c for c in self.avg_color]
+            self.button_style["font_color"] = self.text_color
 
         if changed.get("bot") is True:
             self.button_style["tags"].append("BOT")
@@ -562,8 +702,8 @@ class UserButton_Container:
         # Create surface and title for the container
         self.surf = pygame.Surface((self.w, self.h))
         self.title_text = title
-        self.title = Fonts.title_font.render(
-            self.title_text, False, Colors.LIGHT_BLUE)
+        self.title = cached_render(
+            Fonts.title_font, self.title_text, False, Colors.LIGHT_BLUE)
         self.title_rect = self.title.get_rect(center=(self.w // 2, 30))
 
         # Track user buttons and their arrangement in pages and rows
@@ -581,8 +721,8 @@ class UserButton_Container:
         self.update_pagination()
 
         # Display page number
-        self.page_render = Fonts.notification_font.render(
-            f"{self.current_page+1}/{len(self.user_buttons_list)}", True, Colors.GRAY
+        self.page_render = cached_render(
+            Fonts.notification_font, f"{self.current_page+1}/{len(self.user_buttons_list)}", True, Colors.GRAY
         )
         self.page_render_rect = self.page_render.get_rect(
             center=(
@@ -610,8 +750,8 @@ class UserButton_Container:
             self.title_rect.x + self.title_rect.width + 30,
             self.title_rect.y + self.title_rect.height / 2,
         )
-        self.num_users_text = Fonts.notification_font.render(
-            str(0), True, Colors.WHITE)
+        self.num_users_text = cached_render(
+            Fonts.notification_font, str(0), True, Colors.WHITE)
         self.num_users_text_rect = self.num_users_text.get_rect(
             center=self.num_users_text_center
         )
@@ -694,6 +834,7 @@ class UserButton_Container:
 
     def update_pagination(self):
         """Update pagination buttons based on the current page."""
+        self.mark_dirty()
         self.prev.disable()
         self.first.disable()
         self.next.disable()
@@ -706,10 +847,21 @@ class UserButton_Container:
             self.first.enable()
 
         # Update page number display
-        self.page_render = Fonts.notification_font.render(
-            f"{self.current_page+1}/{len(self.user_buttons_list)}", True, Colors.GRAY,
+        self.page_render = cached_render(
+            Fonts.notification_font, f"{self.current_page+1}/{len(self.user_buttons_list)}", True, Colors.GRAY,
         )
 
+    def mark_dirty(self, rect=None):
+        """Have the container, or a rect of it, redrawn next frame."""
+        if rect is None:
+            rect = (0, 0, self.w, self.h)
+        dirty_rects.mark(pygame.Rect(rect).move(self.x, self.y))
+
+    def mark_button(self, btn):
+        """Have a user button redrawn, if it is on the page being shown."""
+        if btn.page == self.current_page:
+            self.mark_dirty(btn.rect)
+
     def add_page(self):
         """Add a new empty page to the button container."""
         self.user_buttons_list.append([[]])
@@ -722,9 +874,13 @@ class UserButton_Container:
             self.add_page()
 
     def add_user_button(
-        self, user, curr_user: bool, on_click,
+        self, user, curr_user: bool, on_click, refresh=True,
     ):
-        """Add a new user button to the container."""
+        """Add a new user button to the container.
+
+        Pass refresh=False when adding many buttons at once, and call
+        refresh() after the last one.
+        """
         if len(self.user_buttons_list[-1][-1]) >= self.cols:
             self.add_row()
 
@@ -756,13 +912,18 @@ class UserButton_Container:
         self.user_buttons_list[-1][row].append(btn)
 
         self.num_users += 1
+        if refresh:
+            self.refresh()
+
+    def refresh(self):
+        """Re-render the user count and pagination after a batch of changes."""
         self.update_num_users()
         self.update_pagination()
 
     def update_num_users(self):
         """Update the displayed number of users."""
-        self.num_users_text = Fonts.notification_font.render(
-            str(self.num_users), False, Colors.WHITE
+        self.num_users_text = cached_render(
+            Fonts.notification_font, str(self.num_users), False, Colors.WHITE
         )
         self.num_users_text_rect = self.num_users_text.get_rect(
             center=self.num_users_text_center
@@ -777,30 +938,33 @@ class UserButton_Container:
 
         self.user_buttons_list = [[[]]]
 
-        while len(all_buttons) > 0:
+        for btn in all_buttons:
             if len(self.user_buttons_list[-1][-1]) >= self.cols:
                 self.add_row()
 
-            btn = all_buttons.pop(0)
             self.user_buttons_list[-1][-1].append(btn)
 
+            page = len(self.user_buttons_list) - 1
             row, col = len(
                 self.user_buttons_list[-1]) - 1, len(self.user_buttons_list[-1][-1]) - 1
-            btn.update(
-                {
-                    "page": len(self.user_buttons_list) - 1,
-                    "row": row,
-                    "col": col,
-                    "rect": (
-                        col * (self.user_button_w +
-                               self.user_button_gap) + self.user_button_gap,
-                        self.title_rect.height + row *
-                            (self.user_button_h + self.user_button_gap) +
-                        self.user_button_gap,
-                        self.user_button_w,
-                        self.user_button_h,
-                    ),
-                }
+
+            # Only buttons that actually moved need to be rebuilt
+            if (btn.page, btn.row, btn.col) == (page, row, col):
+                continue
+
+            btn.move(
+                page,
+                row,
+                col,
+                (
+                    col * (self.user_button_w +
+                           self.user_button_gap) + self.user_button_gap,
+                    self.title_rect.height + row *
+                        (self.user_button_h + self.user_button_gap) +
+                    self.user_button_gap,
+                    self.user_button_w,
+                    self.user_button_h,
+                ),
             )
 
         if self.current_page >= len(self.user_buttons_list):
@@ -808,19 +972,29 @@ class UserButton_Container:
 
     def remove_user_button(self, id):
         """Remove a user button by its ID."""
-        btn = self.user_buttons.pop(id)
-        row, col, page = btn.row, btn.col, btn.page
-
-        # Remove the button from the list
-        self.user_buttons_list[page][row].pop(col)
-        self.num_users -= 1
+        self.remove_user_buttons([id])
+
+    def remove_user_buttons(self, ids):
+        """Remove several user buttons with a single layout pass."""
+        removed = set()
+        for id in ids:
+            if id in self.user_buttons:
+                removed.add(self.user_buttons.pop(id))
+        if not removed:
+            return
+
+        # Remove the buttons from the list
+        for page in self.user_buttons_list:
+            for row in page:
+                row[:] = [btn for btn in row if btn not in removed]
+        self.num_users -= len(removed)
 
         self.shift_user_buttons()
-        self.update_pagination()
-        self.update_num_users()
+        self.refresh()
 
     def draw(self, win):
         """Draw the container and all user buttons onto the window."""
+        inherit_clip(self.surf, win, self.x, self.y)
         self.surf.fill(Colors.BG_COLOR)
         for row in self.user_buttons_list[self.current_page]:
             for btn in row:
@@ -840,6 +1014,12 @@ class UserButton_Container:
         self.surf.blit(self.page_render, self.page_render_rect)
         win.blit(self.surf, (self.x, self.y))
 
+    def page_ids(self, page):
+        """Get the IDs of the users on a page, none for pages that don't exist."""
+        if not 0 <= page < len(self.user_buttons_list):
+            return []
+        return [btn.id for row in self.user_buttons_list[page] for btn in row]
+
     def check_event(self, e):
         """Check if an event applies to any user button or pagination button."""
         for row in self.user_buttons_list[self.current_page]:
@@ -852,6 +1032,12 @@ class UserButton_Container:
     def update_button(self, user_id, changed):
         """Update the properties of a specific user button."""
         self.user_buttons[user_id].update(changed=changed)
+        self.mark_button(self.user_buttons[user_id])
+
+    def set_avatar(self, user_id, avatar):
+        """Give a user button a prepared avatar."""
+        self.user_buttons[user_id].set_avatar(avatar)
+        self.mark_button(self.user_buttons[user_id])
 
 
 # Class for the profile of a user
@@ -869,8 +1055,8 @@ class Profile:
         self.w, self.h = LEFT_WIDTH, HEIGHT
 
         # Render the title text for the profile
-        self.title = Fonts.user_font.render(
-            user["username"], True, Colors.WHITE
+        self.title = cached_render(
+            Fonts.user_font, user["username"], True, Colors.WHITE
         )
         self.title_rect = self.title.get_rect(center=(LEFT_WIDTH // 2, 100))
 
@@ -902,8 +1088,8 @@ class Profile:
 
         else:
             # Setup for current user's profile
-            self.text = Fonts.user_font.render(
-                "This is you!", True, Colors.CYAN
+            self.text = cached_render(
+                Fonts.user_font, "This is you!", True, Colors.CYAN
             )
             self.text_rect = self.text.get_rect(center=(LEFT_WIDTH // 2, 200))
             self.username_input = Text_Input(
@@ -916,8 +1102,8 @@ class Profile:
                 if len(text) > 0
                 else None,
             )
-            self.change_user_name_text = Fonts.subtitle_font.render(
-                "Change username: ", True, Colors.LIGHT_BLUE
+            self.change_user_name_text = cached_render(
+                Fonts.subtitle_font, "Change username: ", True, Colors.LIGHT_BLUE
             )
             self.change_user_name_text_rect = self.change_user_name_text.get_rect(
                 center=(
@@ -935,8 +1121,8 @@ class Profile:
                 callback=lambda text: on_image_change(
                     text) if len(text) > 0 else None,
             )
-            self.change_image_text = Fonts.subtitle_font.render(
-                "Change Profile Image: ", True, Colors.LIGHT_BLUE
+            self.change_image_text = cached_render(
+                Fonts.subtitle_font, "Change Profile Image: ", True, Colors.LIGHT_BLUE
             )
             self.change_image_text_rect = self.change_image_text.get_rect(
                 center=(
@@ -968,6 +1154,10 @@ class Profile:
                 )
             )
 
+    def mark_dirty(self):
+        """Have the whole profile redrawn next frame."""
+        dirty_rects.mark((0, 0, self.w, self.h))
+
     def draw(self, win):
         """Draw the profile and its components onto the window."""
         if self.bg_image:
@@ -1016,13 +1206,14 @@ class Profile:
 
     def update(self, changed):
         """Update profile with changes in username or image."""
+        self.mark_dirty()
         if changed.get("username"):
             if self.curr_user:
                 self.username_input.update(
                     {"default_text": changed["username"]}
                 )
-            self.title = Fonts.user_font.render(
-                changed["username"], True, Colors.WHITE
+            self.title = cached_render(
+                Fonts.user_font, changed["username"], True, Colors.WHITE
             )
             self.title_rect = self.title.get_rect(
                 center=(LEFT_WIDTH // 2, 100)
@@ -1035,10 +1226,16 @@ class Profile:
             # Set transparency of the background image
             self.bg_image.set_alpha(50)
 
+    def set_background(self, image):
+        """Use an avatar that was already scaled and faded as the background."""
+        self.bg_image = image
+        self.mark_dirty()
+
     def on_disconnect(self):
         """Handle the event when a user disconnects."""
-        self.text = Fonts.user_font.render(
-            "User Disconnected!", True, Colors.CYAN
+        self.mark_dirty()
+        self.text = cached_render(
+            Fonts.user_font, "User Disconnected!", True, Colors.CYAN
         )
         self.text_rect = self.text.get_rect(center=(LEFT_WIDTH // 2, 200))
         self.disable_challenge_buttons()
@@ -1093,8 +1290,8 @@ class Notification_Container:
 
         self.surf = pygame.Surface((self.w, self.h))
         self.title_text = title
-        self.title = Fonts.title_font.render(
-            self.title_text, False, Colors.LIGHT_BLUE
+        self.title = cached_render(
+            Fonts.title_font, self.title_text, False, Colors.LIGHT_BLUE
         )
         self.title_rect = self.title.get_rect(center=(self.w // 2, 30))
 
@@ -1113,8 +1310,8 @@ class Notification_Container:
         self.update_pagination()
 
         # Page render display settings
-        self.page_render = Fonts.notification_font.render(
-            f"{self.current_page+1}/{len(self.neatened_popups)}", True, Colors.GRAY
+        self.page_render = cached_render(
+            Fonts.notification_font, f"{self.current_page+1}/{len(self.neatened_popups)}", True, Colors.GRAY
         )
         self.page_render_rect = self.page_render.get_rect(
             center=(
@@ -1136,8 +1333,8 @@ class Notification_Container:
             self.title_rect.x + self.title_rect.width + 30,
             self.title_rect.y + self.title_rect.height / 2,
         )
-        self.num_noti = Fonts.notification_font.render(
-            str(0), True, Colors.WHITE
+        self.num_noti = cached_render(
+            Fonts.notification_font, str(0), True, Colors.WHITE
         )
         self.num_noti_rect = self.num_noti.get_rect(
             center=self.num_noti_center)
@@ -1198,8 +1395,14 @@ class Notification_Container:
                 button.rect.height,
             )
 
+    def mark_dirty(self):
+        # Have the container redrawn next frame, it sits in the right pane
+        dirty_rects.mark(
+            (self.x + LEFT_WIDTH + GAP_BETWEEN_SECTIONS, self.y, self.w, self.h))
+
     def update_pagination(self):
         # Update the state of pagination buttons based on the current page
+        self.mark_dirty()
         self.prev.disable()
         self.first.disable()
         self.next.disable()
@@ -1209,8 +1412,8 @@ class Notification_Container:
         if self.current_page > 0:
             self.prev.enable()
             self.first.enable()
-        self.page_render = Fonts.notification_font.render(
-            f"{self.current_page+1}/{len(self.neatened_popups)}", True, Colors.GRAY
+        self.page_render = cached_render(
+            Fonts.notification_font, f"{self.current_page+1}/{len(self.neatened_popups)}", True, Colors.GRAY
         )
 
     def move_popups(self):
@@ -1287,8 +1490,8 @@ class Notification_Container:
 
     def update_noti(self):
         # Update the notification count display
-        self.num_noti = Fonts.notification_font.render(
-            str(len(self.popups)), False, Colors.WHITE
+        self.num_noti = cached_render(
+            Fonts.notification_font, str(len(self.popups)), False, Colors.WHITE
         )
         self.num_noti_rect = self.num_noti.get_rect(
             center=self.num_noti_center)
@@ -1323,6 +1526,7 @@ class Notification_Container:
 
     def draw(self, win):
         # Draw the notification container and its contents
+        inherit_clip(self.surf, win, self.x, self.y)
         self.surf.fill(Colors.BG_COLOR)
         if len(self.neatened_popups) > 0:
             for popup in self.neatened_popups[self.current_page]:
@@ -1423,8 +1627,13 @@ class TTT_Board:
         self.board[id].change_text(text)
         self.board[id].disable()
 
+    def animating(self):
+        # Nothing on this board moves by itself
+        return False
+
     def draw(self, win):
         # Draw the board and its buttons
+        inherit_clip(self.surf, win, self.x, self.y)
         self.surf.fill(Colors.BLUE)
         for b in self.board:
             b.update(self.surf)
@@ -1559,8 +1768,17 @@ class Connect4_Board:
                 button.rect.height,
             )
 
+    def animating(self):
+        # The winning coins keep fading in and out once the game is over
+        return self.game_over and len(self.winning_indices) > 0
+
+    def mark_dirty(self):
+        # Have the board redrawn next frame, the game is drawn at the window's corner
+        dirty_rects.mark((self.x, self.y, self.w, self.h))
+
     def draw(self, win):
         # Draw the board and its components
+        inherit_clip(self.surf, win, self.x, self.y)
         if self.game_over and len(self.winning_indices) > 0:
             # Animate the winning coins
             self.winning_coin.set_alpha(self.coin_brigthness)
@@ -1646,6 +1864,7 @@ class Connect4_Board:
 
     def game_over_protocol(self, indices, winner_id, *args):
         # Handle game over state, disable buttons, and set up animation
+        self.mark_dirty()
         for button in self.top_bar_buttons:
             button.hover_image = None
             button.disable()
@@ -1659,6 +1878,7 @@ class Connect4_Board:
     def place(self, to, turn_string):
         # Place a coin in the specified location and update top bar buttons
         self.board[to[0]][to[1]] = turn_string
+        self.mark_dirty()
         if to[0] == 0:
             self.top_bar_buttons[to[1]].hover_image = None
             self.top_bar_buttons[to[1]].disable()
@@ -1705,8 +1925,8 @@ class Game_Template:
             self.title_text += " vs. " if ind < len(self.players) - 1 else ""
 
         # Rendering the title text
-        self.title = Fonts.title_font.render(
-            self.title_text, True, Colors.WHITE)
+        self.title = cached_render(
+            Fonts.title_font, self.title_text, True, Colors.WHITE)
         self.title_rect = self.title.get_rect(center=(self.w // 2, 50))
         self.text = None  # Placeholder for turn or game-over text
         self.set_turn(self.turn_id)
@@ -1716,8 +1936,17 @@ class Game_Template:
         # Flag to indicate if the animated background should be shown
         self.show_animated_bg = False
 
+    def animating(self):
+        # Is something on the game screen moving by itself?
+        return self.show_animated_bg or self.board.animating()
+
+    def mark_dirty(self):
+        # Have the whole game screen redrawn next frame
+        dirty_rects.mark((0, 0, self.w, self.h))
+
     def draw(self, win):
         # Clear the surface with the background color
+        inherit_clip(self.surf, win)
         self.surf.fill(Colors.BG_COLOR)
 
         # Draw animated background if needed
@@ -1737,9 +1966,10 @@ class Game_Template:
     def set_turn(self, turn_id):
         # Update the turn indicator text based on the current turn
         self.turn_id = turn_id
+        self.mark_dirty()
         if self.turn_id == self.curr_user_id:
-            self.text = Fonts.subtitle_font.render(
-                "You are up!", True, Colors.LIGHT_BLUE
+            self.text = cached_render(
+                Fonts.subtitle_font, "You are up!", True, Colors.LIGHT_BLUE
             )
         else:
             turn_username = (
@@ -1747,12 +1977,13 @@ class Game_Template:
                 if len(self.players[turn_id]["username"]) > 5
                 else self.players[turn_id]["username"]
             )
-            self.text = Fonts.subtitle_font.render(
-                f"{turn_username}'s turn!", True, Colors.LIGHT_BLUE
+            self.text = cached_render(
+                Fonts.subtitle_font, f"{turn_username}'s turn!", True, Colors.LIGHT_BLUE
             )
 
     def game_over_protocol(self, game_over_details):
         # Handle the game-over state, including updating the board and showing the result
+        self.mark_dirty()
         winner_id = game_over_details.get("winner_id")
         indices = game_over_details.get("indices")
 
@@ -1809,7 +2040,7 @@ class Game_Template:
                 Sound_Effects.mourn.play()
 
         # Update the text to show the result of the game
-        self.text = Fonts.subtitle_font.render(text, True, Colors.GREEN)
+        self.text = cached_render(Fonts.subtitle_font, text, True, Colors.GREEN)
         self.game_over = True
 
     def check_event(self, e):
@@ -1834,7 +2065,7 @@ class Settings_Page:
         self.surf = pygame.Surface((self.w, self.h))
 
         # Title of the settings page
-        self.title = Fonts.title_font.render("Settings", True, Colors.WHITE)
+        self.title = cached_render(Fonts.title_font, "Settings", True, Colors.WHITE)
         self.title_rect = self.title.get_rect(center=(self.w // 2, 100))
 
         # Buttons for muting music and sound effects
@@ -1883,8 +2114,8 @@ class Settings_Page:
                 Images.unmuted, (50, 50)
             )
 
-            self.mute_music_text = Fonts.subtitle_font.render(
-                "Mute Music: ", True, Colors.LIGHT_BLUE
+            self.mute_music_text = cached_render(
+                Fonts.subtitle_font, "Mute Music: ", True, Colors.LIGHT_BLUE
             )
             self.mute_music_text_rect = self.mute_music_text.get_rect(
                 center=(self.w / 2 - 50, 225)
@@ -1896,8 +2127,8 @@ class Settings_Page:
                 Images.muted, (50, 50)
             )
 
-            self.mute_music_text = Fonts.subtitle_font.render(
-                "Unmute Music: ", True, Colors.LIGHT_BLUE
+            self.mute_music_text = cached_render(
+                Fonts.subtitle_font, "Unmute Music: ", True, Colors.LIGHT_BLUE
             )
             self.mute_music_text_rect = self.mute_music_text.get_rect(
                 center=(self.w / 2 - 50, 225)
@@ -1912,8 +2143,8 @@ class Settings_Page:
                 Images.unmuted, (50, 50)
             )
 
-            self.mute_sound_effect_text = Fonts.subtitle_font.render(
-                "Mute Sound Effects: ", True, Colors.LIGHT_BLUE
+            self.mute_sound_effect_text = cached_render(
+                Fonts.subtitle_font, "Mute Sound Effects: ", True, Colors.LIGHT_BLUE
             )
             self.mute_sound_effect_text_rect = self.mute_sound_effect_text.get_rect(
                 center=(self.w / 2 - 50, 325)
@@ -1925,8 +2156,8 @@ class Settings_Page:
                 Images.muted, (50, 50)
             )
 
-            self.mute_sound_effect_text = Fonts.subtitle_font.render(
-                "Unmute Sound Effects: ", True, Colors.LIGHT_BLUE
+            self.mute_sound_effect_text = cached_render(
+                Fonts.subtitle_font, "Unmute Sound Effects: ", True, Colors.LIGHT_BLUE
             )
             self.mute_sound_effect_text_rect = self.mute_sound_effect_text.get_rect(
                 center=(self.w / 2 - 50, 325)
@@ -1966,6 +2197,7 @@ class Settings_Page:
 
     def draw(self, win):
         # Draw the settings page
+        inherit_clip(self.surf, win, self.x, self.y)
         self.surf.fill(Colors.BG_COLOR)
         self.render_text()
         for button in self.buttons.values():